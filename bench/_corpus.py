@@ -0,0 +1,29 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+
+
+__all__ = ('corpus',)
+
+
+def corpus(n, min_words, max_words, *, vocab, seed=0):
+    """`n` messages of `min_words` to `max_words` words, drawn from a
+    vocabulary of `vocab` words with Zipf-distributed frequencies"""
+    rng = random.Random(seed)
+    words = [f'word{i}' for i in range(vocab)]
+    weights = [1 / (i + 1) for i in range(vocab)]
+    return [' '.join(rng.choices(words, weights, k=rng.randint(min_words, max_words))) for _ in range(n)]
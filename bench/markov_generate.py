@@ -0,0 +1,83 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Latency of Markov.gen_msg(250, 10).
+
+Compares the cached cumulative weights used by Chain and CompactChain with
+the previous sampling, which rebuilt the candidate lists and called
+random.choices on every step.
+
+    python bench/markov_generate.py [--messages 20000] [--calls 200]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pikalaxbot.cogs.markov import Markov
+from pikalaxbot.cogs.utils.markov import Chain, CompactChain
+from _corpus import corpus
+
+
+class UncachedChain(Chain):
+    def _Chain__weighted_choice(self, state):
+        items = self.tbl[state]
+        return random.choices(list(items), list(items.values()))[0]
+
+
+class UncachedCompactChain(CompactChain):
+    def _next_id(self, key):
+        slot = self.multi.get(key)
+        if slot is not None:
+            return random.choices(self.ids[slot], self.counts[slot])[0]
+        packed = self.single.get(key)
+        if packed is not None:
+            return packed >> self.bits
+
+
+def measure(cls, messages, calls):
+    chain = cls()
+    for message in messages:
+        chain.learn_str(message)
+    # gen_msg only needs the chain and the set of stored messages
+    cog = types.SimpleNamespace(chain=chain, storedMsgsSet=set(messages))
+    random.seed(1)
+    Markov.gen_msg(cog, 250, 10)  # warm the caches
+    start = time.perf_counter()
+    for _ in range(calls):
+        Markov.gen_msg(cog, 250, 10)
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    messages = corpus(args.messages, 5, 40, vocab=5000)
+    print(f'{len(messages)} messages, mean of {args.calls} gen_msg(250, 10) calls')
+    for before, after in ((UncachedChain, Chain), (UncachedCompactChain, CompactChain)):
+        print(f'{after.__name__:>12}: before {measure(before, messages, args.calls) * 1000:5.2f} ms, '
+              f'after {measure(after, messages, args.calls) * 1000:5.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Memory per learned transition of Chain and CompactChain.
+
+Learns a synthetic corpus of Zipf-distributed words under tracemalloc and
+reports the bytes allocated per transition, plus the learning time.
+
+    python bench/markov_memory.py [--messages 25000]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pikalaxbot.cogs.utils.markov import Chain, CompactChain
+from _corpus import corpus
+
+
+def measure(cls, messages):
+    tracemalloc.start()
+    start = time.perf_counter()
+    chain = cls()
+    for message in messages:
+        chain.learn_str(message)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return chain, size, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=25000)
+    args = parser.parse_args()
+
+    messages = corpus(args.messages, 1, 25, vocab=20000)
+    # Every message learns one transition per word plus the end of message
+    transitions = sum(len(m.split()) + 1 for m in messages)
+    print(f'{len(messages)} messages, {transitions} transitions')
+    for cls in (Chain, CompactChain):
+        chain, size, elapsed = measure(cls, messages)
+        print(f'{cls.__name__:>12}: {size / 2 ** 20:6.1f} MiB, '
+              f'{size / transitions:5.0f} bytes/transition, learned in {elapsed:.2f} s')
+        del chain
+
+
+if __name__ == '__main__':
+    main()
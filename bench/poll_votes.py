@@ -0,0 +1,121 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Vote queries against the unkeyed and the keyed poll schemas.
+
+Fills a database with votes spread over many polls using the poll cog's own
+migrations, then times inserting a vote, retracting it, listing a poll's
+votes and deleting a whole poll.  Each operation is timed both on its own
+and including the commit.
+
+    python bench/poll_votes.py [--votes 100000] [--polls 2000] [--ops 500]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pikalaxbot.cogs.poll import _poll_schema_v1, _poll_schema_v2
+
+
+class Connection:
+    """Just enough of the Sql interface to run the migrations"""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def execute(self, *args):
+        return self.db.execute(*args)
+
+    async def execute_fetchall(self, *args):
+        return self.db.execute(*args).fetchall()
+
+
+def build(path, migrations, votes, polls):
+    db = sqlite3.connect(path)
+    conn = Connection(db)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(_poll_schema_v1(conn))
+    rng = random.Random(1)
+    codes = [f'C{i:06d}' for i in range(polls)]
+    db.executemany('insert into polls (code, channel, owner, context, message, started, closes) values (?, 1, 2, 3, 4, 5, 6)',
+                   [(code,) for code in codes])
+    db.executemany('insert into poll_options (code, voter, option) values (?, ?, ?)',
+                   [(codes[i % polls], 10 ** 6 + i, rng.randrange(10)) for i in range(votes)])
+    db.commit()
+    for migration in migrations:
+        loop.run_until_complete(migration(conn))
+        db.commit()
+    loop.close()
+    return db, codes
+
+
+def timeit(db, statement, args, commit):
+    times = []
+    for arg in args:
+        start = time.perf_counter()
+        db.execute(statement, arg).fetchall()
+        if commit:
+            db.commit()
+        times.append((time.perf_counter() - start) * 1e6)
+    if not commit:
+        db.commit()
+    times.sort()
+    return f'{statistics.median(times):.0f}/{times[int(len(times) * 0.99)]:.0f}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--votes', type=int, default=100000)
+    parser.add_argument('--polls', type=int, default=2000)
+    parser.add_argument('--ops', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f'{args.votes} votes over {args.polls} polls, {args.ops} operations, times in us (median/p99)')
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, migrations in (('v1', ()), ('v2', (_poll_schema_v2,))):
+            path = os.path.join(tmpdir, f'{name}.db')
+            db, codes = build(path, migrations, args.votes, args.polls)
+            rng = random.Random(2)
+            votes = [(rng.choice(codes), 5 * 10 ** 6 + i, 3) for i in range(args.ops)]
+            for commit in (False, True):
+                # Fresh voters each round, so the inserts never collide
+                offset = commit * 10 ** 6
+                insert = timeit(db, 'insert into poll_options (code, voter, option) values (?, ?, ?)',
+                                [(code, voter + offset, option) for code, voter, option in votes], commit)
+                retract = timeit(db, 'delete from poll_options where code = ? and voter = ?',
+                                 [(code, voter + offset) for code, voter, _ in votes], commit)
+                select = timeit(db, 'select voter, option from poll_options where code = ?',
+                                [(code,) for code, _, _ in votes], commit)
+                print(f'{name} {"commit" if commit else "stmt":>6}: insert {insert}, '
+                      f'delete(code, voter) {retract}, select(code) {select}')
+            start = time.perf_counter()
+            db.execute('delete from poll_options where code = ?', (codes[7],))
+            db.commit()
+            elapsed = (time.perf_counter() - start) * 1e6
+            db.close()
+            print(f'{name}: delete(code) {elapsed:.0f} us, file size {os.path.getsize(path) // 1024} KiB')
+
+
+if __name__ == '__main__':
+    main()
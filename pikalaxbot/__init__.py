@@ -15,16 +15,25 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
+import copy
 import discord
 from discord.ext import commands
+from discord.ext.commands.view import StringView
 import logging
 import os
 import glob
+import time
 from .utils.config_io import Settings
-from .utils.sql import connect
+from .utils.sql import SqlPool
+from .utils.timeseries import TimeSeriesStore
 from .utils.logging_mixin import LoggingMixin
 
-from .ext.twitch import *
+from .cogs import BaseCog
+from .cogs.utils.history import HistoryIngest
+from .cogs.utils.plot import PlotRenderer
+from .cogs.utils.loop_monitor import LoopMonitor
+from .cogs.utils.reactions import ReactionRouter
+from .cogs.utils.scheduler import Scheduler
 from .cogs.utils.errors import *
 
 
@@ -35,15 +44,16 @@ __dir__ = os.path.dirname(__file__) or '.'
 async def _command_prefix(bot, message):
     if message.guild is None:
         return ''
-    if message.guild.id not in bot.guild_prefixes:
-        async with bot.sql as sql:
-            bot.guild_prefixes[message.guild.id] = await sql.get_prefix(bot, message)
-    return bot.guild_prefixes[message.guild.id]
+    try:
+        return bot.guild_prefixes[message.guild.id]
+    except KeyError:
+        return await bot.fetch_guild_prefix(message.guild)
 
 
 class PikalaxBOT(LoggingMixin, commands.Bot):
     filter_excs = commands.CommandNotFound, commands.CheckFailure
     handle_excs = commands.UserInputError, CogOperationError
+    context_ttl = 60
 
     def __init__(self, settings_file, logfile, sqlfile, *, loop=None):
         # Load settings
@@ -52,7 +62,18 @@ class PikalaxBOT(LoggingMixin, commands.Bot):
         disabled_cogs = self.settings.disabled_cogs
         super().__init__(_command_prefix, case_insensitive=True, loop=loop, activity=discord.Game(self.settings.game))
         self.guild_prefixes = {}
-        self._sql = sqlfile
+        self._prefix_futures = {}
+        self._prefixes_loaded = asyncio.Event()
+        self.history_ingest = HistoryIngest(self)
+        self.plot_renderer = PlotRenderer(loop=loop)
+        self.loop_monitor = LoopMonitor(self)
+        self.reaction_router = ReactionRouter()
+        self.add_listener(self.reaction_router.on_raw_reaction_add)
+        self.add_listener(self.reaction_router.on_raw_reaction_remove)
+        self.scheduler = Scheduler(self)
+        self._context_cache = {}
+        self.sql_pool = SqlPool(sqlfile, storage=self.settings.sql_storage, loop=self.loop)
+        self.timeseries = TimeSeriesStore(self.sql_pool, loop=self.loop)
 
         # Set up logger
         self.logger.setLevel(logging.DEBUG if self.settings.debug else logging.INFO)
@@ -62,6 +83,7 @@ class PikalaxBOT(LoggingMixin, commands.Bot):
         self.logger.addHandler(handler)
 
         # Load cogs
+        self.extension_timings = {}
         for cogfile in glob.glob(f'{__dir__}/cogs/*.py'):
             if os.path.isfile(cogfile) and '__init__' not in cogfile:
                 cogname = os.path.splitext(os.path.basename(cogfile))[0]
@@ -77,27 +99,133 @@ class PikalaxBOT(LoggingMixin, commands.Bot):
                         self.logger.info(f'Loaded extn "{cogname}"')
                 else:
                     self.logger.info(f'Skipping disabled extn "{cogname}"')
+        self.report_extension_timings()
 
         async def init_sql():
-            async with self.sql as sql:
-                await sql.db_init(self)
+            try:
+                async with self.sql as sql:
+                    await self.timeseries.init_db(sql)
+                    await self.scheduler.init_db(sql)
+                    await sql.db_init(self)
+                    self.guild_prefixes.update(await sql.get_all_prefixes())
+            except Exception as e:
+                self.logger.exception('Failed to initialize the database')
+                self.timeseries.abort(e)
+            finally:
+                # Prefix lookups fall back to querying one guild at a time
+                self._prefixes_loaded.set()
 
         self.loop.create_task(init_sql())
+        self.settings.start_watching()
+        self.loop_monitor.start()
+        self.scheduler.start()
 
         # Reboot handler
         self.reboot_after = True
 
-        # Twitch bot
-        self._twitch_bot = create_twitch_bot(self)
+        # Twitch bot, only imported if configured
+        if self.settings.twitch_token:
+            from .ext.twitch import create_twitch_bot
+            self._twitch_bot = create_twitch_bot(self)
+        else:
+            self._twitch_bot = None
         self._alive_since = None
 
+    def _load_from_module_spec(self, spec, key):
+        # Time the module import separately from its setup function
+        loader = spec.loader
+        exec_module = loader.exec_module
+        timings = self.extension_timings[key] = {'import': 0.0}
+
+        def timed_exec_module(module):
+            start = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                timings['import'] = time.perf_counter() - start
+
+        loader.exec_module = timed_exec_module
+        start = time.perf_counter()
+        try:
+            super()._load_from_module_spec(spec, key)
+        finally:
+            timings['setup'] = time.perf_counter() - start - timings['import']
+
+    def report_extension_timings(self):
+        total = 0.0
+        lines = []
+        for key, timings in sorted(self.extension_timings.items(), key=lambda t: -sum(t[1].values())):
+            total += sum(timings.values())
+            lines.append(f'  {key}: import {timings["import"]:.3f}s, setup {timings["setup"]:.3f}s')
+        self.logger.info(f'Loaded {len(lines)} extensions in {total:.3f}s\n' + '\n'.join(lines))
+
     async def tmi_dispatch(self, event, *args, **kwargs):
         if self._twitch_bot is not None:
             await self._twitch_bot._dispatch(event, *args, **kwargs)
 
+    async def get_context(self, message, *, cls=commands.Context):
+        """Parse each message once.  Command processing and every on_message
+        listener asking for the same message share one parse, but each gets
+        its own copy of the Context, since invoking a command mutates it."""
+        if cls is not commands.Context:
+            return await super().get_context(message, cls=cls)
+        entry = self._context_cache.get(message.id)
+        if entry is not None and entry[1] is message:
+            return self._copy_context(await asyncio.shield(entry[2]))
+        now = time.monotonic()
+        while self._context_cache:
+            oldest = next(iter(self._context_cache))
+            if self._context_cache[oldest][0] > now - self.context_ttl:
+                break
+            del self._context_cache[oldest]
+        task = self.loop.create_task(super().get_context(message))
+        self._context_cache.pop(message.id, None)
+        self._context_cache[message.id] = (now, message, task)
+        return self._copy_context(await asyncio.shield(task))
+
+    @staticmethod
+    def _copy_context(ctx):
+        result = copy.copy(ctx)
+        result.view = StringView(ctx.view.buffer)
+        result.view.index = ctx.view.index
+        result.view.previous = ctx.view.previous
+        result.args = list(ctx.args)
+        result.kwargs = dict(ctx.kwargs)
+        return result
+
+    async def fetch_guild_prefix(self, guild):
+        """Resolve a guild's prefix that is not in the cache yet.
+        Concurrent misses for the same guild share one lookup."""
+        await self._prefixes_loaded.wait()
+        if guild.id in self.guild_prefixes:
+            return self.guild_prefixes[guild.id]
+        fut = self._prefix_futures.get(guild.id)
+        if fut is None:
+            async def load():
+                try:
+                    async with self.sql as sql:
+                        prefix = await sql.get_prefix(self, guild)
+                    self.guild_prefixes[guild.id] = prefix
+                    return prefix
+                finally:
+                    self._prefix_futures.pop(guild.id, None)
+
+            fut = self._prefix_futures[guild.id] = self.loop.create_task(load())
+        return await asyncio.shield(fut)
+
+    async def set_guild_prefix(self, guild, prefix):
+        """Update a guild's prefix in both the cache and the database."""
+        self.guild_prefixes[guild.id] = prefix
+        async with self.sql as sql:
+            await sql.set_prefix(guild, prefix)
+
     @property
     def sql(self):
-        return connect(self._sql, loop=self.loop)
+        return self.sql_pool.acquire()
+
+    @property
+    def sql_reader(self):
+        return self.sql_pool.acquire(readonly=True)
 
     def run(self):
         self.logger.info('Starting bot')
@@ -108,6 +236,21 @@ class PikalaxBOT(LoggingMixin, commands.Bot):
         self.logger.info('Logout request received')
         await self.close()
 
+    async def close(self):
+        for name, cog in list(self.cogs.items()):
+            if isinstance(cog, BaseCog):
+                try:
+                    await cog.close()
+                except Exception:
+                    self.logger.exception(f'Failed to close cog "{name}"')
+        await super().close()
+        self.loop_monitor.stop()
+        self.scheduler.stop()
+        await self.settings.close()
+        await self.timeseries.close()
+        await self.sql_pool.close()
+        self.plot_renderer.close()
+
     @property
     def owner(self):
         return self.get_user(self.owner_id)
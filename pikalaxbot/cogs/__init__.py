@@ -16,6 +16,7 @@
 
 import typing
 import collections
+import copy
 
 from discord.ext import commands
 from pikalaxbot.utils.logging_mixin import LoggingMixin
@@ -36,6 +37,7 @@ class BaseCog(LoggingMixin, commands.Cog):
         settings.  When subclassing BaseCog, define this at the class level.
     """
     config_attrs: typing.Tuple[str] = tuple()
+    _settings_generation = None
 
     def __init__(self, bot):
         super().__init__()
@@ -45,6 +47,10 @@ class BaseCog(LoggingMixin, commands.Cog):
         """Override this"""
         pass
 
+    async def close(self):
+        """Override this.  Called when the bot is shutting down."""
+        pass
+
     async def fetch(self):
         """
         Loads local attributes from the bot's settings
@@ -59,15 +65,20 @@ class BaseCog(LoggingMixin, commands.Cog):
                     continue
                 if isinstance(val, list):
                     val = set(val)
+                elif isinstance(val, dict):
+                    # Copy so that in-place changes register as changes on commit
+                    val = copy.deepcopy(val)
                 old_attr = getattr(self, attr)
                 if isinstance(old_attr, collections.defaultdict):
                     old_attr.clear()
                     old_attr.update(val)
                     val = old_attr
                 setattr(self, attr, val)
+            self._settings_generation = self.bot.settings.generation
 
     async def cog_before_invoke(self, ctx):
-        await self.fetch()
+        if self.config_attrs and self._settings_generation != self.bot.settings.generation:
+            await self.fetch()
 
     async def commit(self):
         """
@@ -78,8 +89,15 @@ class BaseCog(LoggingMixin, commands.Cog):
                 self.log_debug(attr)
                 val = getattr(self, attr)
                 if isinstance(val, set):
+                    if val == set(getattr(settings, attr) or ()):
+                        continue
                     val = list(val)
+                elif isinstance(val, (dict, list)):
+                    # Never share the container with Settings, or the next
+                    # in-place change would compare equal to what it holds
+                    val = copy.deepcopy(val)
                 setattr(settings, attr, val)
 
     async def cog_after_invoke(self, ctx):
-        await self.commit()
+        if self.config_attrs:
+            await self.commit()
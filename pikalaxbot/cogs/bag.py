@@ -24,7 +24,7 @@ class Bag(BaseCog):
     async def bag(self, ctx):
         """Get in the bag, Nebby."""
         if ctx.invoked_subcommand is None:
-            async with self.bot.sql as sql:
+            async with self.bot.sql_reader as sql:
                 message = await sql.read_bag()
             if message is None:
                 emoji = find_emoji(ctx.bot, 'BibleThump', case_sensitive=False)
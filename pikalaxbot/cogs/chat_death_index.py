@@ -1,42 +1,54 @@
-from collections import defaultdict, Counter
+from collections import Counter, defaultdict
+import asyncio
 import discord
 import datetime
 from discord.ext import commands, tasks
 from . import BaseCog
+from .utils.cdi import CDIAccumulator
+from .utils.plot import PlotSpec
 import typing
+import heapq
 import io
 import time
-import matplotlib.pyplot as plt
+import numpy as np
 
 
 class ChatDeathIndex(BaseCog):
     MIN_SAMPLES = 5
     MAX_SAMPLES = 30
+    CHARS_PER_WORD = 6
+    # Dashboards requested in the last DASHBOARD_TTL seconds are re-rendered each minute
+    DASHBOARD_TTL = 600
+    DASHBOARD_TOP = 10
+    DASHBOARD_MAX_TOP = 25
 
     def __init__(self, bot):
         super().__init__(bot)
-        self.cdi_samples = defaultdict(list)
-        self.calculations = defaultdict(list)
+        # One row per tracked channel, one sample (characters sent) per minute
+        self.accumulator = CDIAccumulator(ChatDeathIndex.MAX_SAMPLES, scale=ChatDeathIndex.CHARS_PER_WORD)
         self.cumcharcount = Counter()
+        # When any window last changed, for caching plots
+        self.updated = None
+        self.dashboard_requests: typing.Dict[typing.Tuple[int, bool, int], float] = {}
         self.save_message_count.start()
 
     def cog_unload(self):
         self.save_message_count.cancel()
 
-    def plot(self, channels: typing.Tuple[discord.TextChannel], buffer):
-        plt.figure()
-        for channel in channels:
-            samples = self.calculations[channel.id]
-            plt.plot(list(range(1 - len(samples), 1)), samples, label=f'#{channel}')
-        plt.xlabel('Minutes ago')
-        plt.ylabel('CDI')
-        plt.legend(loc=0)
-        plt.savefig(buffer)
-        plt.close()
+    def history(self, channel_id: int) -> np.ndarray:
+        """CDI of the channel over the last MAX_SAMPLES minutes, oldest first"""
+        return ChatDeathIndex.to_cdi_array(self.accumulator.history(channel_id))
 
-    @staticmethod
-    def get_message_cdi_effect(message: discord.Message) -> float:
-        return len(message.clean_content) / 6
+    def plot(self, channels: typing.Iterable[discord.TextChannel]) -> PlotSpec:
+        plot = PlotSpec(legend=True)
+        for channel in channels:
+            if channel.id not in self.accumulator:
+                continue
+            samples = self.history(channel.id)
+            plot.plot(list(range(1 - len(samples), 1)), samples, label=f'#{channel}')
+        plot.set_xlabel('Minutes ago')
+        plot.set_ylabel('CDI')
+        return plot
 
     @staticmethod
     def can_get_messages(channel: typing.Any) -> bool:
@@ -52,91 +64,148 @@ class ChatDeathIndex(BaseCog):
 
     @tasks.loop(seconds=60, reconnect=True)
     async def save_message_count(self):
-        for channel in self.bot.get_all_channels():
-            self.cdi_samples[channel.id].append(self.cumcharcount[channel.id])
-            self.cdi_samples[channel.id] = self.cdi_samples[channel.id][-ChatDeathIndex.MAX_SAMPLES:]
-            self.calculations[channel.id].append(ChatDeathIndex.samples_to_cdi(self.cdi_samples[channel.id]))
-            self.calculations[channel.id] = self.calculations[channel.id][-ChatDeathIndex.MAX_SAMPLES:]
-            self.cumcharcount[channel.id] = 0
-
-    async def init_channel(self, channel: discord.TextChannel, now):
+        now = time.time()
+        latest = np.zeros(len(self.accumulator), dtype=np.int64)
+        for channel_id, count in self.cumcharcount.items():
+            row = self.accumulator.rows.get(channel_id)
+            if row is not None:
+                latest[row] = count
+                if count:
+                    self.bot.timeseries.append(f'cdi.{channel_id}', now, count)
+        self.cumcharcount.clear()
+        self.accumulator.push(latest)
+        self.updated = now
+        # Quiet minutes are not stored, so mark that this minute was observed
+        self.bot.timeseries.append('cdi', now, len(self.accumulator))
+        self.prerender_dashboards(now)
+
+    def prerender_dashboards(self, now):
+        for (guild_id, nsfw, top), requested in list(self.dashboard_requests.items()):
+            guild = self.bot.get_guild(guild_id)
+            if guild is None or requested < now - ChatDeathIndex.DASHBOARD_TTL:
+                del self.dashboard_requests[guild_id, nsfw, top]
+            else:
+                self.bot.loop.create_task(self.prerender_dashboard(guild, nsfw, top))
+
+    async def prerender_dashboard(self, guild, nsfw, top):
+        try:
+            await self.render_dashboard(guild, nsfw, top)
+        except Exception:
+            self.bot.logger.exception(f'Failed to render the CDI dashboard of guild {guild.id}')
+
+    def dashboard_channels(self, guild: discord.Guild, nsfw: bool, top: int) -> typing.List[discord.TextChannel]:
+        """The `top` most active tracked channels of the guild"""
+        channels = [ch for ch in guild.text_channels if ch.is_nsfw() <= nsfw and ch.id in self.accumulator]
+        if len(channels) > top:
+            averages = self.accumulator.current()
+            channels = heapq.nlargest(top, channels, key=lambda ch: averages[self.accumulator.rows[ch.id]])
+        return sorted(channels, key=lambda ch: ch.position)
+
+    async def render_dashboard(self, guild: discord.Guild, nsfw: bool, top: int) -> bytes:
+        # Keyed by the last update, so it renders at most once per minute
+        key = 'cdi-dashboard', guild.id, nsfw, top, self.updated
+        return await self.bot.plot_renderer.render(key, lambda: self.plot(self.dashboard_channels(guild, nsfw, top)))
+
+    async def init_channel(self, channel: discord.TextChannel, now, stored=(), resume=None):
+        """Rebuild the channel's window from stored samples, then read the
+        history posted since `resume`, or the whole window if not given."""
+        if not ChatDeathIndex.can_get_messages(channel):
+            return
         start = now - datetime.timedelta(minutes=2 * ChatDeathIndex.MAX_SAMPLES - 1)
-        if ChatDeathIndex.can_get_messages(channel):
-            self.cdi_samples[channel.id] = [0 for _ in range(2 * ChatDeathIndex.MAX_SAMPLES - 1)]
-            async for message in channel.history(before=now, after=start):  # type: discord.Message
-                if await self.msg_counts_against_chat_death(message):
-                    idx = int((message.created_at - start).total_seconds()) // 60
-                    self.cdi_samples[channel.id][idx] += ChatDeathIndex.get_message_cdi_effect(message)
-        for i in range(ChatDeathIndex.MAX_SAMPLES):
-            self.calculations[channel.id].append(ChatDeathIndex.samples_to_cdi(self.cdi_samples[channel.id][i:i + ChatDeathIndex.MAX_SAMPLES]))
-        self.cdi_samples[channel.id] = self.cdi_samples[channel.id][-ChatDeathIndex.MAX_SAMPLES:]
+        samples = [0 for _ in range(2 * ChatDeathIndex.MAX_SAMPLES - 1)]
+        for ts, value in stored:
+            # A sample covers the minute ending at its timestamp
+            idx = int((datetime.datetime.utcfromtimestamp(ts - 1) - start).total_seconds()) // 60
+            if 0 <= idx < len(samples):
+                samples[idx] += int(value)
+
+        async def count(message: discord.Message):
+            if await self.msg_counts_against_chat_death(message):
+                idx = int((message.created_at - start).total_seconds()) // 60
+                samples[idx] += len(message.clean_content)
+
+        after = start if resume is None else max(resume, start)
+        await self.bot.history_ingest.fetch(channel, count, before=now, after=after)
+        self.accumulator.load(channel.id, samples)
+        self.updated = time.time()
         self.cumcharcount[channel.id] = 0
 
     @save_message_count.before_loop
     async def start_message_count(self):
         await self.bot.wait_until_ready()
-        now = datetime.datetime.now()
-
-        for channel in self.bot.get_all_channels():
-            await self.init_channel(channel, now)
+        now = datetime.datetime.utcnow()
+        since = time.time() - 60 * (2 * ChatDeathIndex.MAX_SAMPLES - 1)
+        stored = defaultdict(list)
+        resume = None
+        for series, ts, value in await self.bot.timeseries.fetch_family('cdi', since):
+            if series == 'cdi':
+                resume = datetime.datetime.utcfromtimestamp(ts)
+            else:
+                stored[int(series[4:])].append((ts, value))
+        await asyncio.gather(*(
+            self.init_channel(channel, now, stored.get(channel.id, ()), resume)
+            for channel in self.bot.get_all_channels()
+        ))
 
     @staticmethod
     def to_cdi(avg):
         return round((avg - 64) ** 2 * 2.3) * ((-1) ** (avg >= 64))
 
     @staticmethod
-    def accumulate(samples):
-        n = len(samples)
-        if n == 0:
-            return 0
-        return 2 * sum((i + 1) * x for i, x in enumerate(samples)) / (n * (n + 1))
-
-    @staticmethod
-    def samples_to_cdi(samples):
-        return ChatDeathIndex.to_cdi(ChatDeathIndex.accumulate(samples))
+    def to_cdi_array(avg: np.ndarray) -> np.ndarray:
+        return np.round((avg - 64) ** 2 * 2.3) * np.where(avg >= 64, -1, 1)
 
     @BaseCog.listener()
     async def on_message(self, message: discord.Message):
-        if await self.msg_counts_against_chat_death(message):
-            self.cumcharcount[message.channel.id] += ChatDeathIndex.get_message_cdi_effect(message)
+        if message.channel.id in self.accumulator and await self.msg_counts_against_chat_death(message):
+            self.cumcharcount[message.channel.id] += len(message.clean_content)
 
     @commands.command(name='cdi')
     async def get_cdi(self, ctx: commands.Context, channel: discord.TextChannel = None):
         """Returns the Chat Death Index of the given channel (if not specified, uses the current channel)"""
         channel = channel or ctx.channel
-        chat_avg = self.cdi_samples[channel.id]
-        n = len(chat_avg)
-        if n < ChatDeathIndex.MIN_SAMPLES:
+        if channel.id not in self.accumulator or self.accumulator.count(channel.id) < ChatDeathIndex.MIN_SAMPLES:
             await ctx.send(f'I cannot determine the Chat Death Index of {channel.mention} at this time.')
         else:
-            accum = ChatDeathIndex.accumulate(chat_avg)
+            accum = self.accumulator.average(channel.id)
             cdi = ChatDeathIndex.to_cdi(accum)
             await ctx.send(f'Current Chat Death Index of {channel.mention}: {cdi} ({accum:.3f})')
 
     @commands.command(name='plot-cdi')
     async def plot_cdi(self, ctx: commands.Context, *channels: discord.TextChannel):
         """Plots the Chat Death Index history of the given channel (if not specified, uses the current channel)"""
-        channels = set(channels) or (ctx.channel,)
+        channels = sorted(set(channels) or (ctx.channel,), key=lambda channel: channel.position)
         async with ctx.typing():
-            mem_buffer = io.BytesIO()
             start = time.perf_counter()
-            await self.bot.loop.run_in_executor(None, self.plot, channels, mem_buffer)
+            key = 'cdi', tuple(channel.id for channel in channels), self.updated
+            png = await self.bot.plot_renderer.render(key, lambda: self.plot(channels))
             end = time.perf_counter()
-            mem_buffer.seek(0)
-            file = discord.File(mem_buffer, filename='cdi.png')
+            file = discord.File(io.BytesIO(png), filename='cdi.png')
         await ctx.send(f'Task completed in {end - start:.3f}s', file=file)
 
+    @commands.guild_only()
     @commands.command(name='plot-all-cdi')
-    async def plot_all_cdi(self, ctx: commands.Context):
+    async def plot_all_cdi(self, ctx: commands.Context, top: int = DASHBOARD_TOP):
+        """Plots the Chat Death Index history of the most active channels in this guild"""
+        top = max(1, min(top, ChatDeathIndex.DASHBOARD_MAX_TOP))
         nsfw = ctx.channel.is_nsfw()
-        chs = [ch for ch in ctx.guild.text_channels if ch.is_nsfw() <= nsfw and ChatDeathIndex.can_get_messages(ch)]
-        await self.plot_cdi(ctx, *chs)
+        self.dashboard_requests[ctx.guild.id, nsfw, top] = time.time()
+        async with ctx.typing():
+            start = time.perf_counter()
+            png = await self.render_dashboard(ctx.guild, nsfw, top)
+            end = time.perf_counter()
+            file = discord.File(io.BytesIO(png), filename='cdi.png')
+        await ctx.send(f'Task completed in {end - start:.3f}s', file=file)
+
+    @BaseCog.listener()
+    async def on_guild_channel_create(self, channel: discord.abc.GuildChannel):
+        if ChatDeathIndex.can_get_messages(channel):
+            self.accumulator.add(channel.id)
 
     @BaseCog.listener()
     async def on_guild_join(self, guild: discord.Guild):
-        now = datetime.datetime.now()
-        for channel in guild.text_channels:
-            await self.init_channel(channel, now)
+        now = datetime.datetime.utcnow()
+        await asyncio.gather(*(self.init_channel(channel, now) for channel in guild.text_channels))
 
 
 def setup(bot):
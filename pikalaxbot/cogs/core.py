@@ -21,6 +21,7 @@ import resource
 import typing
 import inspect
 import os
+import time
 import datetime
 
 from . import BaseCog
@@ -130,6 +131,34 @@ class Core(BaseCog):
             unit = 'B'
         await ctx.send(f'Total resources used: {rss:.3f} {unit}')
 
+    @commands.command(name='loop-lag', aliases=['lag'])
+    async def loop_lag(self, ctx):
+        """Event loop lag and recent slow callbacks"""
+        monitor = self.bot.loop_monitor
+        now = time.time()
+        lines = ['Loop lag (ms)', f'{"window":>6} {"n":>6} {"p50":>6} {"p99":>6} {"max":>6}']
+        for minutes in (1, 5, 60):
+            s = monitor.lag.summary(60 * minutes, now)
+            if s['count']:
+                lines.append(f'{minutes:>5}m {s["count"]:>6} {s["p50"]:>6.1f} {s["p99"]:>6.1f} {s["max"]:>6.1f}')
+        lines.append(f'Worst lag since boot: {monitor.max_lag * 1000:.0f} ms')
+        lines.append(f'Slow callbacks (>= {monitor.slow_callback_duration * 1000:.0f} ms): {monitor.slow_callback_count}')
+        for cb in reversed(monitor.slow_callbacks):
+            when = datetime.datetime.utcfromtimestamp(cb.timestamp).strftime('%H:%M:%S')
+            lines.append(f'{when} {cb.duration * 1000:>6.0f} ms {cb.name}' + (f' ({cb.cog})' if cb.cog else ''))
+        await ctx.send('```\n' + '\n'.join(lines)[:1900] + '\n```')
+
+    @commands.is_owner()
+    @commands.command()
+    async def timers(self, ctx):
+        """Pending scheduled deadlines"""
+        now = time.time()
+        lines = [f'{len(self.bot.scheduler)} pending']
+        for deadline in self.bot.scheduler.pending()[:40]:
+            what = deadline.event or getattr(deadline.callback, '__qualname__', repr(deadline.callback))
+            lines.append(f'{deadline.when - now:>9.1f}s {deadline.key!r:.40} {what}')
+        await ctx.send('```\n' + '\n'.join(lines)[:1900] + '\n```')
+
 
 def setup(bot):
     bot.add_cog(Core(bot))
@@ -23,7 +23,6 @@ from contextlib import redirect_stdout
 from pikalaxbot.utils.hastebin import hastebin
 
 import aiohttp
-from import_expression import exec
 
 import asyncio
 import discord
@@ -113,8 +112,10 @@ class Eval(BaseCog):
         stdout = io.StringIO()
 
         try:
+            # Imported on first use, it is only needed here
+            import import_expression
             to_compile = f'async def func():\n{textwrap.indent(body, "  ")}'
-            exec(to_compile, env)
+            import_expression.exec(to_compile, env)
         except Exception as e:
             return await ctx.send(f'```py\n{e.__class__.__name__}: {e}\n```')
 
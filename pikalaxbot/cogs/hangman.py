@@ -63,9 +63,7 @@ class HangmanGame(GameBase):
 
     async def end(self, ctx: commands.Context, failed=False, aborted=False):
         if self.running:
-            if self._task and not self._task.done():
-                self._task.cancel()
-                self._task = None
+            self.cancel_timeout()
             await self._message.edit(content=self)
             if aborted:
                 await ctx.send(f'Game terminated by {ctx.author.mention}.\n'
@@ -32,7 +32,7 @@ class Leaderboard(BaseCog):
         """Check your leaderboard score, or the leaderboard score of another user"""
         if person is None:
             person = ctx.author
-        async with self.bot.sql as sql:
+        async with self.bot.sql_reader as sql:
             try:
                 score, rank = await sql.get_leaderboard_rank(person)
                 await ctx.send(f'{person.name} has {score:d} point(s) across all games '
@@ -44,7 +44,7 @@ class Leaderboard(BaseCog):
     async def show(self, ctx):
         """Check the top 10 players on the leaderboard"""
         msgs = []
-        async with self.bot.sql as sql:
+        async with self.bot.sql_reader as sql:
             async for _id, name, score in sql.get_all_scores():
                 msgs.append(f'{name}: {score:d}')
         if len(msgs) == 0:
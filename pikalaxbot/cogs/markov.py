@@ -14,14 +14,18 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import os
 import re
+import struct
 import typing
+import mmap
 
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 from . import BaseCog
-from .utils.markov import Chain
+from .utils.markov import CompactChain, dump_snapshot, load_snapshot
 
 
 class Markov(BaseCog):
@@ -32,9 +36,58 @@ class Markov(BaseCog):
         super().__init__(bot)
         self.initialized = False
         self.storedMsgsSet = set()
-        self.chain = Chain(store_lowercase=True)
+        self.chain = CompactChain(store_lowercase=True)
+        self.high_water = {}
         self.bot.loop.create_task(self.init_chain())
 
+    def cog_unload(self):
+        self.save_snapshot.cancel()
+
+    async def close(self):
+        self.save_snapshot.cancel()
+        if self.initialized:
+            await self.write_snapshot()
+
+    @property
+    def snapshot_file(self):
+        return os.path.join(os.path.dirname(self.bot.sql_pool.database), 'markov.snapshot')
+
+    @staticmethod
+    def read_snapshot(fname):
+        with open(fname, 'rb') as fp:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                return load_snapshot(buffer)
+
+    @staticmethod
+    def replace_file(fname, data):
+        tmpname = f'{fname}.tmp'
+        with open(tmpname, 'wb') as fp:
+            fp.write(data)
+            # Make sure the data is on disk before the rename is
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmpname, fname)
+
+    async def load_snapshot(self):
+        try:
+            self.chain, self.high_water, messages = await self.bot.loop.run_in_executor(None, self.read_snapshot, self.snapshot_file)
+        except (OSError, ValueError, IndexError, struct.error) as e:
+            # Missing, truncated or corrupt, rebuild from history instead
+            self.bot.logger.warning(f'Markov: not loading snapshot: {e}')
+            return False
+        self.storedMsgsSet.update(messages)
+        self.bot.logger.info(f'Markov: loaded snapshot of {len(self.chain)} states')
+        return True
+
+    async def write_snapshot(self):
+        # Serialize on the event loop, so the chain cannot change underneath us
+        data = dump_snapshot(self.chain, self.high_water, self.storedMsgsSet)
+        await self.bot.loop.run_in_executor(None, self.replace_file, self.snapshot_file, data)
+
+    @tasks.loop(minutes=15)
+    async def save_snapshot(self):
+        await self.write_snapshot()
+
     def cog_check(self, ctx: commands.Context):
         # Check that the cog is initialized
         if not self.initialized:
@@ -71,6 +124,8 @@ class Markov(BaseCog):
         if message.channel.id in self.markov_channels:
             self.storedMsgsSet.add(message.clean_content)
             self.chain.learn_str(message.clean_content)
+            if message.id > self.high_water.get(message.channel.id, 0):
+                self.high_water[message.channel.id] = message.id
 
     def forget_markov(self, message):
         if message.channel.id in self.markov_channels:
@@ -78,8 +133,9 @@ class Markov(BaseCog):
 
     async def learn_markov_from_history(self, channel: discord.TextChannel):
         if channel.permissions_for(channel.guild.me).read_message_history:
-            async for msg in channel.history(limit=5000):
-                self.learn_markov(msg)
+            # Only catch up on what was said since the snapshot, if there is one
+            after = self.high_water.get(channel.id)
+            await self.bot.history_ingest.fetch(channel, self.learn_markov, after=after, limit=5000)
             self.bot.logger.info(f'Markov: Initialized channel {channel}')
             return True
         self.bot.logger.error(f'Markov: missing ReadMessageHistory permission for {channel}')
@@ -88,6 +144,8 @@ class Markov(BaseCog):
     async def init_chain(self):
         await self.bot.wait_until_ready()
         await self.fetch()
+        await self.load_snapshot()
+        channels = []
         for ch in list(self.markov_channels):
             self.bot.logger.debug('%d', ch)
             channel = self.bot.get_channel(ch)
@@ -95,8 +153,10 @@ class Markov(BaseCog):
                 self.bot.logger.error(f'Markov: unable to find text channel {ch:d}')
                 self.markov_channels.discard(ch)
             else:
-                await self.learn_markov_from_history(channel)
+                channels.append(channel)
+        await asyncio.gather(*map(self.learn_markov_from_history, channels))
         self.initialized = True
+        self.save_snapshot.start()
 
     @commands.check(lambda ctx: len(ctx.cog.markov_channels) != 0)
     @commands.group(hidden=True, invoke_without_command=True)
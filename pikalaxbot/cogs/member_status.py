@@ -1,72 +1,150 @@
+import asyncio
 import discord
 from discord.ext import commands, tasks
 from collections import Counter, defaultdict
 from . import BaseCog
+from .utils.plot import PlotSpec
+from .utils.rollup import RollupSeries
 import time
+import typing
 import datetime
 import io
-import matplotlib.pyplot as plt
 
 
 class MemberStatus(BaseCog):
+    # How much of the stored history to load on startup
+    preload = datetime.timedelta(days=7)
+    # One column per status, plus one for anything else
+    statuses = discord.Status.online, discord.Status.idle, discord.Status.dnd, discord.Status.offline
+
     def __init__(self, bot):
         super().__init__(bot)
-        self.counters = defaultdict(list)
+        self.counters = defaultdict(lambda: RollupSeries(len(self.statuses) + 1))
+        # Live status counts per available guild, kept up to date by events
+        self.tallies: typing.Dict[int, Counter] = {}
         self.update_counters.start()
+        self.reconcile_tallies.start()
         self.start_time = None
 
+    def cog_unload(self):
+        self.update_counters.cancel()
+        self.reconcile_tallies.cancel()
+
+    def count_guild(self, guild: discord.Guild):
+        self.tallies[guild.id] = Counter(m.status for m in guild.members)
+
     @tasks.loop(seconds=30)
     async def update_counters(self):
-        tick = time.perf_counter()
-        for guild in self.bot.guilds:
-            self.counters[guild.id].append(Counter(m.status for m in guild.members))
-        tock = time.perf_counter()
-        self.update_counters.change_interval(seconds=30 - (tock - tick))
+        now = time.time()
+        for guild_id, counter in self.tallies.items():
+            self.counters[guild_id].append(now, self.tally(counter))
+            for status, count in counter.items():
+                if count:
+                    self.bot.timeseries.append(f'status.{guild_id}.{status}', now, count)
+
+    @tasks.loop(minutes=10)
+    async def reconcile_tallies(self):
+        """Recount every guild in case an event was missed, one guild at a
+        time so that large guilds do not hold up the event loop for long"""
+        for guild in list(self.bot.guilds):
+            if guild.unavailable or guild.id not in self.tallies:
+                continue
+            counter = Counter(m.status for m in guild.members)
+            if counter != +self.tallies[guild.id]:
+                self.log_debug(f'Status tally for guild {guild.id} drifted, recounted')
+            self.tallies[guild.id] = counter
+            await asyncio.sleep(0)
+
+    @reconcile_tallies.before_loop
+    async def reconcile_tallies_before_loop(self):
+        await self.bot.wait_until_ready()
+        await asyncio.sleep(self.reconcile_tallies.minutes * 60)
 
     @update_counters.before_loop
     async def update_counters_before_loop(self):
         await self.bot.wait_until_ready()
-        self.start_time = datetime.datetime.utcnow()
+        for guild in self.bot.guilds:
+            if not guild.unavailable:
+                self.count_guild(guild)
+        since = time.time() - self.preload.total_seconds()
+        samples = defaultdict(dict)
+        for series, ts, value in await self.bot.timeseries.fetch_family('status.', since):
+            _, guild_id, status = series.split('.', 2)
+            samples[int(guild_id)].setdefault(ts, Counter())[discord.enums.try_enum(discord.Status, status)] = int(value)
+        for guild_id, counters in samples.items():
+            for ts, counter in sorted(counters.items()):
+                self.counters[guild_id].append(ts, self.tally(counter))
+        start = min((series.start for series in self.counters.values()), default=None)
+        self.start_time = datetime.datetime.utcnow() if start is None else datetime.datetime.utcfromtimestamp(start)
+
+    @BaseCog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.status != after.status:
+            counter = self.tallies.get(after.guild.id)
+            if counter is not None:
+                counter[before.status] -= 1
+                counter[after.status] += 1
+
+    @BaseCog.listener()
+    async def on_member_join(self, member: discord.Member):
+        counter = self.tallies.get(member.guild.id)
+        if counter is not None:
+            counter[member.status] += 1
 
-    def do_plot_status_history(self, buffer, ctx, history):
+    @BaseCog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        counter = self.tallies.get(member.guild.id)
+        if counter is not None:
+            counter[member.status] -= 1
+
+    @BaseCog.listener()
+    async def on_guild_available(self, guild: discord.Guild):
+        self.count_guild(guild)
+
+    @BaseCog.listener()
+    async def on_guild_join(self, guild: discord.Guild):
+        self.count_guild(guild)
+
+    @BaseCog.listener()
+    async def on_guild_unavailable(self, guild: discord.Guild):
+        self.tallies.pop(guild.id, None)
+
+    @BaseCog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        self.tallies.pop(guild.id, None)
+
+    def tally(self, counter: Counter):
+        return [counter[status] for status in self.statuses] + [sum(count for status, count in counter.items() if status not in self.statuses)]
+
+    def status_plot(self, guild_id, history) -> PlotSpec:
         mapping = {
             discord.Status.online: '#43B581',
-            discord.Status.offline: '#747F8D',
-            discord.Status.dnd: '#F04747',
             discord.Status.idle: '#FAA61A',
+            discord.Status.dnd: '#F04747',
+            discord.Status.offline: '#747F8D',
             'other': '#7289DA'
         }
 
-        values = self.counters[ctx.guild.id]
-        if history > 0:
-            values = values[-2 * history:]
-        history = len(values)
-        plt.figure()
-        counts = {key: [v[key] for v in values] for key in mapping}
-        counts['other'] = [sum(v[key] for key in v if key not in mapping) for v in values]
-        for key, value in counts.items():
-            plt.plot(range(history), value, c=mapping[key], label=str(key).title())
-        xtickvalues = list(range(0, history, history // 10 + (history % 10 != 0)))
-        xticklabels = [(self.start_time + datetime.timedelta(seconds=i * 30)).strftime('%Y-%m-%d\nT%H:%M:%S') for i in xtickvalues]
-        plt.xticks(xtickvalues, xticklabels, rotation=45, ha='right', ma='right')
-        plt.xlabel('Time (UTC)')
-        plt.ylabel('Number of users')
-        plt.legend(loc=0)
-        plt.tight_layout()
-        plt.savefig(buffer)
-        plt.close()
+        since = time.time() - 60 * history if history > 0 else 0
+        rollup = self.counters[guild_id].select(since)
+        times = [datetime.datetime.utcfromtimestamp(t) for t in rollup.times]
+        plot = PlotSpec(legend=True, autofmt_xdate=True, tight_layout=True)
+        for i, key in enumerate((*self.statuses, 'other')):
+            plot.plot(times, rollup.means[:, i], c=mapping[key], label=str(key).title())
+        plot.set_xlabel('Time (UTC)' if rollup.raw else f'Time (UTC, {rollup.step // 60} min average)')
+        plot.set_ylabel('Number of users')
+        return plot
 
     @commands.guild_only()
     @commands.check(lambda ctx: ctx.cog.start_time)
     @commands.command(name='userstatus')
     async def plot_status(self, ctx, history=60):
         """Plot history of user status counts in the current guild."""
-        buffer = io.BytesIO()
         start = time.perf_counter()
-        await self.bot.loop.run_in_executor(None, self.do_plot_status_history, buffer, ctx, history * 2)
+        key = 'status', ctx.guild.id, history, self.counters[ctx.guild.id].last
+        png = await self.bot.plot_renderer.render(key, lambda: self.status_plot(ctx.guild.id, history))
         end = time.perf_counter()
-        buffer.seek(0)
-        await ctx.send(f'Completed in {end - start:.3f}s', file=discord.File(buffer, 'ping.png'))
+        await ctx.send(f'Completed in {end - start:.3f}s', file=discord.File(io.BytesIO(png), 'status.png'))
 
 
 def setup(bot):
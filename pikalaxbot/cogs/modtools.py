@@ -136,6 +136,14 @@ class Modtools(BaseCog):
             await ctx.send('The script failed with an error (check your syntax?)', embed=embed)
         self.log_tb(ctx, exc)
 
+    @admin.command(name='sql-stats')
+    async def sql_stats(self, ctx):
+        """Show database connection pool metrics"""
+
+        stats = self.bot.sql_pool.stats()
+        s = '\n'.join(f'{key}: {value:.3f}' if isinstance(value, float) else f'{key}: {value}' for key, value in stats.items())
+        await ctx.send(f'```\n{s}\n```')
+
     @admin.command(name='oauth')
     async def send_oauth(self, ctx: commands.Context):
         """Sends the bot's OAUTH token."""
@@ -298,9 +306,7 @@ class Modtools(BaseCog):
     async def change_prefix(self, ctx, prefix='p!'):
         """Update the bot's command prefix"""
 
-        async with self.bot.sql as sql:
-            await sql.set_prefix(ctx.guild, prefix)
-        self.bot.guild_prefixes[ctx.guild.id] = prefix
+        await self.bot.set_guild_prefix(ctx.guild, prefix)
         await ctx.message.add_reaction('✅')
 
     @admin.command()
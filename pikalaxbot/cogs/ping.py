@@ -1,16 +1,35 @@
+import asyncio
+import aiohttp
 import discord
 from discord.ext import commands, tasks
 from . import BaseCog
+from .utils.latency import LatencySketch
+from .utils.plot import PlotSpec
+from .utils.rollup import RollupSeries
 import io
+import json
+import math
 import time
 import datetime
-import matplotlib.pyplot as plt
 
 
 class Ping(BaseCog):
+    # How much of the stored history to load on startup
+    preload = datetime.timedelta(days=7)
+    # Windows reported by ping stats and ping dump, in minutes
+    stats_windows = 5, 60, 1440
+
     def __init__(self, bot):
         super().__init__(bot)
-        self.ping_history = []
+        self.ping_history = RollupSeries(1)
+        # heartbeat: gateway heartbeat ACK delay
+        # rest: time to complete a GET /gateway request
+        # roundtrip: delay between a ping command and the bot's reply
+        self.latency = {
+            'heartbeat': LatencySketch(),
+            'rest': LatencySketch(),
+            'roundtrip': LatencySketch(),
+        }
         self.build_ping_history.start()
         self.start_time = None
 
@@ -19,47 +38,88 @@ class Ping(BaseCog):
 
     @tasks.loop(seconds=30)
     async def build_ping_history(self):
-        self.ping_history.append(self.bot.latency * 1000)
+        now = time.time()
+        latency = self.bot.latency * 1000
+        if math.isfinite(latency):
+            self.ping_history.append(now, (latency,))
+            self.bot.timeseries.append('ping', now, latency)
+            self.latency['heartbeat'].record(latency, now)
+        start = time.perf_counter()
+        try:
+            await self.bot.http.get_gateway()
+        except (discord.GatewayNotFound, aiohttp.ClientError, asyncio.TimeoutError):
+            # A failed probe is not a latency sample
+            pass
+        else:
+            self.latency['rest'].record((time.perf_counter() - start) * 1000, now)
 
     @build_ping_history.before_loop
     async def before_ping_history(self):
         await self.bot.wait_until_ready()
-        self.start_time = datetime.datetime.utcnow()
+        since = time.time() - self.preload.total_seconds()
+        for ts, value in await self.bot.timeseries.fetch('ping', since):
+            self.ping_history.append(ts, (value,))
+        start = self.ping_history.start
+        self.start_time = datetime.datetime.utcnow() if start is None else datetime.datetime.utcfromtimestamp(start)
 
     @commands.group(invoke_without_command=True)
     async def ping(self, ctx: commands.Context):
         new = await ctx.send('Pong!')
         delta = new.created_at - ctx.message.created_at
+        self.latency['roundtrip'].record(delta.total_seconds() * 1000)
         await new.edit(content=f'Pong!\n'
                                f'Round trip: {delta.total_seconds() * 1000:.0f} ms\n'
                                f'Heartbeat latency: {self.bot.latency * 1000:.0f} ms')
 
-    def do_plot_ping(self, buffer, history):
-        values = self.ping_history
-        if history > 0:
-            values = values[-2 * history:]
-        history = len(values)
-        plt.figure()
-        plt.plot(range(history), values)
-        plt.fill_between(range(history), [0 for _ in values], values)
-        xtickvalues = list(range(0, history, history // 10 + (history % 10 != 0)))
-        xticklabels = [(self.start_time + datetime.timedelta(seconds=i * 30)).strftime('%Y-%m-%d\nT%H:%M:%S') for i in xtickvalues]
-        plt.xticks(xtickvalues, xticklabels, rotation=45, ha='right', ma='right')
-        plt.xlabel('Time (UTC)')
-        plt.ylabel('Heartbeat latency (ms)')
-        plt.tight_layout()
-        plt.savefig(buffer)
-        plt.close()
+    def latency_stats(self):
+        now = time.time()
+        return {
+            source: [sketch.summary(60 * window, now) for window in self.stats_windows]
+            for source, sketch in self.latency.items()
+        }
+
+    @ping.command(name='stats')
+    async def ping_stats(self, ctx: commands.Context):
+        """Latency percentiles over the last 5 minutes, hour and day"""
+        def fmt(value):
+            return '-' if value is None else f'{value:.0f}'
+
+        lines = [f'{"source":<10} {"window":>6} {"n":>6} {"p50":>6} {"p95":>6} {"p99":>6} {"max":>6}']
+        for source, summaries in self.latency_stats().items():
+            for s in summaries:
+                lines.append(f'{source:<10} {s["window"] // 60:>5}m {s["count"]:>6} '
+                             f'{fmt(s["p50"]):>6} {fmt(s["p95"]):>6} {fmt(s["p99"]):>6} {fmt(s["max"]):>6}')
+        await ctx.send('Latency (ms)\n```\n' + '\n'.join(lines) + '\n```')
+
+    @ping.command(name='dump')
+    async def ping_dump(self, ctx: commands.Context):
+        """Latency percentiles as JSON"""
+        data = {'timestamp': time.time(), 'unit': 'ms', 'sources': self.latency_stats()}
+        buffer = io.BytesIO(json.dumps(data, indent=2).encode())
+        await ctx.send(file=discord.File(buffer, 'latency.json'))
+
+    def ping_plot(self, history) -> PlotSpec:
+        since = time.time() - 60 * history if history > 0 else 0
+        rollup = self.ping_history.select(since)
+        times = [datetime.datetime.utcfromtimestamp(t) for t in rollup.times]
+        plot = PlotSpec(autofmt_xdate=True, tight_layout=True)
+        plot.plot(times, rollup.means[:, 0])
+        if rollup.raw:
+            plot.fill_between(times, 0, rollup.means[:, 0])
+        else:
+            plot.fill_between(times, rollup.mins[:, 0], rollup.maxs[:, 0], alpha=0.5)
+        plot.set_xlabel('Time (UTC)' if rollup.raw else f'Time (UTC, {rollup.step // 60} min min/mean/max)')
+        plot.set_ylabel('Heartbeat latency (ms)')
+        return plot
 
     @commands.check(lambda ctx: ctx.cog.start_time)
     @ping.command(name='history', aliases=['graph', 'plot'])
     async def plot_ping(self, ctx, history=60):
-        buffer = io.BytesIO()
         start = time.perf_counter()
-        await self.bot.loop.run_in_executor(None, self.do_plot_ping, buffer, history * 2)
+        key = 'ping', history, self.ping_history.last
+        png = await self.bot.plot_renderer.render(key, lambda: self.ping_plot(history))
         end = time.perf_counter()
-        buffer.seek(0)
-        await ctx.send(f'Completed in {end - start:.3f}s', file=discord.File(buffer, 'ping.png'))
+        await ctx.send(f'Completed in {end - start:.3f}s', file=discord.File(io.BytesIO(png), 'ping.png'))
 
 
 def setup(bot):
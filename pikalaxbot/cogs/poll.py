@@ -22,15 +22,63 @@ import io
 from discord.ext import commands
 from . import BaseCog
 import datetime
+import time
 import traceback
 import typing
 import base64
+import itertools
+import json
 from collections import Counter
 
 from .utils.errors import *
 from pikalaxbot.utils.hastebin import hastebin
 
 
+async def _poll_schema_v1(sql):
+    # The unkeyed tables, with the columns added to polls over time
+    await sql.execute('create table if not exists polls (code text, channel integer, owner integer, context integer, message integer, started timestamp, closes timestamp)')
+    await sql.execute('create table if not exists poll_options (code text, voter integer, option integer)')
+    columns = {name for _, name, *_ in await sql.execute_fetchall('pragma table_info(polls)')}
+    for column, decl in (('options', 'text'), ('emojis', 'text'), ('live', 'integer default 0')):
+        if column not in columns:
+            await sql.execute(f'alter table polls add column {column} {decl}')
+
+
+async def _poll_schema_v2(sql):
+    # Key polls by code and votes by (code, voter).  Every query on
+    # poll_options filters on a prefix of its key and the table holds
+    # nothing else, so the key is a covering index and the rowid is dropped.
+    await sql.execute('create table polls_v2 ('
+                      'code text not null primary key, '
+                      'channel integer not null, '
+                      'owner integer not null, '
+                      'context integer not null, '
+                      'message integer not null, '
+                      'started real not null, '
+                      'closes real not null, '
+                      'options text, '
+                      'emojis text, '
+                      'live integer not null default 0'
+                      ') without rowid')
+    await sql.execute('insert or replace into polls_v2 '
+                      'select code, channel, owner, context, message, started, closes, options, emojis, coalesce(live, 0) from polls '
+                      'where code is not null')
+    await sql.execute('create table poll_options_v2 ('
+                      'code text not null, '
+                      'voter integer not null, '
+                      'option integer not null, '
+                      'primary key (code, voter)'
+                      ') without rowid')
+    # Votes of polls which no longer exist are dropped
+    await sql.execute('insert or replace into poll_options_v2 '
+                      'select code, voter, option from poll_options '
+                      'where code in (select code from polls_v2) and voter is not null and option is not null')
+    await sql.execute('drop table polls')
+    await sql.execute('drop table poll_options')
+    await sql.execute('alter table polls_v2 rename to polls')
+    await sql.execute('alter table poll_options_v2 rename to poll_options')
+
+
 class PollManager:
     __slots__ = (
         'bot',
@@ -45,12 +93,17 @@ class PollManager:
         'start_time',
         'stop_time',
         'emojis',
-        'task',
-        'unloading'
+        'tally',
+        'live',
+        'dirty',
+        'closed',
     )
 
+    # Votes are written, and live results edited, at most this often
+    FLUSH_INTERVAL = 3.0
+
     @classmethod
-    async def from_command(cls, context, timeout, prompt, *options):
+    async def from_command(cls, context, timeout, prompt, *options, live=False):
         this = cls()
         this.bot = context.bot
         this.channel_id = context.channel.id
@@ -60,6 +113,10 @@ class PollManager:
         this.start_time = datetime.datetime.utcnow()
         this.hash = base64.b32encode((hash(this) & 0xFFFFFFFF).to_bytes(4, 'little')).decode().rstrip('=')
         this.votes = {}
+        this.tally = Counter()
+        this.live = live
+        this.dirty = set()
+        this.closed = False
         this.emojis = [f'{i + 1}\u20e3' if i < 9 else '\U0001f51f' for i in range(len(options))]
         content = f'Vote using emoji reactions. ' \
                   f'You have {timeout:d} seconds from when the last option appears. ' \
@@ -67,8 +124,9 @@ class PollManager:
                   f'To change your vote, clear your original selection first. ' \
                   f'The poll author may not cast a vote. ' \
                   f'The poll author may cancel the poll using `{context.prefix}{context.cog.cancel.qualified_name} {this.hash}`'
-        description = '\n'.join(f'{emoji}: {option}' for emoji, option in zip(this.emojis, options))
-        embed = discord.Embed(title=prompt, description=description)
+        if live:
+            content += ' Results are updated as votes come in.'
+        embed = discord.Embed(title=prompt, description=this.describe())
         embed.set_author(name=context.author.display_name, icon_url=context.author.avatar_url)
         this.message = await context.send(content, embed=embed)
         for emoji in this.emojis:
@@ -77,32 +135,53 @@ class PollManager:
         this.stop_time = datetime.datetime.utcnow() + datetime.timedelta(seconds=timeout)
         this.start()
         async with this.bot.sql as sql:
-            await sql.execute('insert into polls (code, channel, owner, context, message, started, closes) values (?, ?, ?, ?, ?, ?, ?)', (this.hash, this.channel_id, this.owner_id, this.context_id, this.message_id, this.start_time.timestamp(), this.stop_time.timestamp()))
+            await sql.execute('insert into polls (code, channel, owner, context, message, started, closes, options, emojis, live) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (this.hash, this.channel_id, this.owner_id, this.context_id, this.message_id, this.start_time.timestamp(), this.stop_time.timestamp(), json.dumps(this.options), json.dumps(this.emojis), live))
         return this
 
     @classmethod
-    async def from_sql(cls, bot, sql, my_hash, channel_id, owner_id, context_id, message_id, start_time, stop_time):
+    def from_sql(cls, bot, votes, my_hash, channel_id, owner_id, context_id, message_id, start_time, stop_time, options, emojis, live):
+        """Rehydrate a poll from its row and votes.  The message is not
+        fetched until the results need editing."""
         this = cls()
         this.bot = bot
         this.channel_id = channel_id
         this.context_id = context_id
         this.message_id = message_id
-        try:
-            this.message = await bot.get_channel(channel_id).fetch_message(message_id)
-            this.options = [option.split(' ', 1)[1] for option in this.message.embeds[0].description.splitlines()]
-            this.emojis = [f'{i + 1}\u20e3' if i < 9 else '\U0001f51f' for i in range(len(this.options))]
-        except discord.HTTPException:
-            this.message = None
-            this.options = []
-            this.emojis = []
+        this.message = None
+        this.options = json.loads(options) if options is not None else None
+        this.emojis = json.loads(emojis) if emojis is not None else None
         this.owner_id = owner_id
-        this.votes = dict(await sql.execute_fetchall('select voter, option from poll_options where code = ?', (my_hash,)))
+        this.votes = votes
+        this.tally = Counter(votes.values())
+        this.live = bool(live)
+        this.dirty = set()
+        this.closed = False
         this.hash = my_hash
         this.start_time = datetime.datetime.fromtimestamp(start_time)
         this.stop_time = datetime.datetime.fromtimestamp(stop_time)
-        this.start()
         return this
 
+    async def fetch_message(self) -> typing.Optional[discord.Message]:
+        if self.message is None:
+            channel = self.bot.get_channel(self.channel_id)
+            if channel is None:
+                return None
+            try:
+                self.message = await channel.fetch_message(self.message_id)
+            except discord.HTTPException:
+                return None
+        return self.message
+
+    async def load_options(self):
+        """Recover the options of a poll saved before they were stored,
+        from its message"""
+        message = await self.fetch_message()
+        try:
+            self.options = [option.split(' ', 1)[1] for option in message.embeds[0].description.splitlines()]
+        except (AttributeError, IndexError):
+            self.options = []
+        self.emojis = [f'{i + 1}\u20e3' if i < 9 else '\U0001f51f' for i in range(len(self.options))]
+
     def __eq__(self, other):
         if isinstance(other, PollManager):
             return hash(self) == hash(other)
@@ -120,8 +199,6 @@ class PollManager:
         return hash((self.start_time.timestamp(), self.channel_id, self.owner_id))
 
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
-        if payload.message_id != self.message_id:
-            return
         if payload.emoji.name not in self.emojis:
             return
         if payload.user_id in (self.owner_id, self.bot.user.id):
@@ -130,12 +207,10 @@ class PollManager:
             return
         selection = self.emojis.index(payload.emoji.name)
         self.votes[payload.user_id] = selection
-        async with self.bot.sql as sql:
-            await sql.execute('insert into poll_options (code, voter, option) values (?, ?, ?)', (self.hash, payload.user_id, selection))
+        self.tally[selection] += 1
+        self.mark_dirty(payload.user_id)
 
     async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
-        if payload.message_id != self.message_id:
-            return
         if payload.emoji.name not in self.emojis:
             return
         if payload.user_id in (self.owner_id, self.bot.user.id):
@@ -144,32 +219,74 @@ class PollManager:
         if self.votes.get(payload.user_id) != selection:
             return
         self.votes.pop(payload.user_id)
+        self.tally[selection] -= 1
+        self.mark_dirty(payload.user_id)
+
+    def describe(self, counts=False):
+        lines = (f'{emoji}: {option}' for emoji, option in zip(self.emojis, self.options))
+        if counts:
+            lines = (f'{line} ({self.tally[i]})' for i, line in enumerate(lines))
+        return '\n'.join(lines)
+
+    @property
+    def timer_key(self):
+        return f'poll.{self.hash}'
+
+    @property
+    def flush_key(self):
+        return f'poll-flush.{self.hash}'
+
+    def mark_dirty(self, voter):
+        self.dirty.add(voter)
+        if self.flush_key not in self.bot.scheduler:
+            self.bot.scheduler.schedule(self.flush_key, time.time() + self.FLUSH_INTERVAL, self.flush)
+
+    async def flush(self):
+        """Write the votes changed since the last flush in one transaction,
+        and show the new counts if the poll is live"""
+        self.bot.scheduler.cancel(self.flush_key)
         async with self.bot.sql as sql:
-            await sql.execute('delete from poll_options where code = ? and voter = ?', (self.hash, payload.user_id))
+            # Taken under the lease, so that nothing is written after the
+            # poll's rows are deleted
+            dirty, self.dirty = self.dirty, set()
+            if not dirty or self.closed:
+                return
+            await sql.executemany('replace into poll_options (code, voter, option) values (?, ?, ?)', [(self.hash, voter, self.votes[voter]) for voter in dirty if voter in self.votes])
+            await sql.executemany('delete from poll_options where code = ? and voter = ?', [(self.hash, voter) for voter in dirty if voter not in self.votes])
+        if self.live:
+            message = await self.fetch_message()
+            if message is not None and message.embeds:
+                embed = message.embeds[0]
+                embed.description = self.describe(counts=True)
+                try:
+                    await message.edit(embed=embed)
+                except discord.HTTPException:
+                    pass
 
     def start(self):
-        self.unloading = False
-        now = datetime.datetime.utcnow()
-        if now > self.stop_time:
+        remaining = (self.stop_time - datetime.datetime.utcnow()).total_seconds()
+        if remaining < 0:
             self.bot.dispatch('poll_end', self)
             return
-        self.bot.add_listener(self.on_raw_reaction_add)
-        self.bot.add_listener(self.on_raw_reaction_remove)
-
-        async def run():
-            try:
-                await asyncio.sleep((self.stop_time - datetime.datetime.utcnow()).total_seconds())
-            finally:
-                self.bot.remove_listener(self.on_raw_reaction_add)
-                self.bot.remove_listener(self.on_raw_reaction_remove)
-                if not self.unloading:
-                    self.bot.dispatch('poll_end', self)
+        self.bot.reaction_router.register(self.message_id, self.on_raw_reaction_add, self.on_raw_reaction_remove)
+        # Persisted, so the poll still closes if the bot restarts in the meantime
+        self.bot.scheduler.schedule_event(self.timer_key, time.time() + remaining, 'poll_deadline', self.hash)
 
-        self.task = asyncio.create_task(run())
+    def finish(self):
+        self.closed = True
+        self.bot.scheduler.cancel(self.flush_key)
+        self.bot.reaction_router.unregister(self.message_id)
+        self.bot.dispatch('poll_end', self)
 
     def cancel(self, unloading=False):
-        self.unloading = unloading
-        self.task.cancel()
+        if unloading:
+            # The deadline stays scheduled for when the cog is loaded again
+            self.bot.reaction_router.unregister(self.message_id)
+            if self.dirty:
+                self.bot.loop.create_task(self.flush())
+        else:
+            self.bot.scheduler.cancel(self.timer_key)
+            self.finish()
 
     async def convert(self, ctx, argument):
         mgr = discord.utils.get(ctx.cog.polls, hash=argument)
@@ -190,17 +307,25 @@ class Poll(BaseCog):
         for mgr in self.polls:
             mgr.cancel(True)
 
+    async def close(self):
+        await asyncio.gather(*[mgr.flush() for mgr in self.polls if mgr.dirty])
+
     async def init_db(self, sql):
-        await sql.execute('create table if not exists polls (code text, channel integer, owner integer, context integer, message integer, started timestamp, closes timestamp)')
-        await sql.execute('create table if not exists poll_options (code text, voter integer, option integer)')
+        await sql.migrate('poll', (_poll_schema_v1, _poll_schema_v2))
 
     async def cache_polls(self):
         await self.bot.wait_until_ready()
         try:
-            async with self.bot.sql as sql:
-                for row in await sql.execute_fetchall('select * from polls'):
-                    mgr = await PollManager.from_sql(self.bot, sql, *row)
-                    self.polls.append(mgr)
+            async with self.bot.sql_reader as sql:
+                rows = await sql.execute_fetchall('select code, channel, owner, context, message, started, closes, options, emojis, live from polls')
+                votes = await sql.execute_fetchall('select code, voter, option from poll_options order by code')
+            votes = {code: {voter: option for _, voter, option in group} for code, group in itertools.groupby(votes, key=lambda row: row[0])}
+            for row in rows:
+                mgr = PollManager.from_sql(self.bot, votes.get(row[0], {}), *row)
+                if mgr.options is None:
+                    await mgr.load_options()
+                self.polls.append(mgr)
+                mgr.start()
         except Exception:
             s = traceback.format_exc()
             tb = f'Ignoring exception in Poll.cache_polls\n{s}'
@@ -220,11 +345,7 @@ class Poll(BaseCog):
 
 
 
-    @commands.group(name='poll', invoke_without_command=True)
-    async def poll_cmd(self, ctx: commands.Context, timeout: typing.Optional[int], prompt, *opts):
-        """Create a poll with up to 10 options.  Poll will last for 60 seconds, with sudden death
-        tiebreakers as needed.  Use quotes to enclose multi-word prompt and options.
-        Optionally, pass an int before the prompt to indicate the number of seconds the poll lasts."""
+    async def create_poll(self, ctx: commands.Context, timeout, prompt, opts, live=False):
         timeout = timeout or Poll.TIMEOUT
         # Do it this way because `set` does weird things with ordering
         options = []
@@ -236,9 +357,22 @@ class Poll(BaseCog):
             raise TooManyOptions('Too many options!')
         if nopts < 2:
             raise NotEnoughOptions('Not enough unique options!')
-        mgr = await PollManager.from_command(ctx, timeout, prompt, *options)
+        mgr = await PollManager.from_command(ctx, timeout, prompt, *options, live=live)
         self.polls.append(mgr)
 
+    @commands.group(name='poll', invoke_without_command=True)
+    async def poll_cmd(self, ctx: commands.Context, timeout: typing.Optional[int], prompt, *opts):
+        """Create a poll with up to 10 options.  Poll will last for 60 seconds, with sudden death
+        tiebreakers as needed.  Use quotes to enclose multi-word prompt and options.
+        Optionally, pass an int before the prompt to indicate the number of seconds the poll lasts."""
+        await self.create_poll(ctx, timeout, prompt, opts)
+
+    @poll_cmd.command(name='live')
+    async def live_poll(self, ctx: commands.Context, timeout: typing.Optional[int], prompt, *opts):
+        """Create a poll whose message shows the vote counts as they come in.
+        Takes the same arguments as the poll command."""
+        await self.create_poll(ctx, timeout, prompt, opts, live=True)
+
     @poll_cmd.command()
     async def cancel(self, ctx: commands.Context, mgr: PollManager):
         """Cancel a running poll using a code. You must be the one who started the poll
@@ -269,6 +403,12 @@ class Poll(BaseCog):
         else:
             await ctx.send('No running polls')
 
+    @BaseCog.listener()
+    async def on_poll_deadline(self, code):
+        mgr = discord.utils.get(self.polls, hash=code)
+        if mgr is not None:
+            mgr.finish()
+
     @BaseCog.listener()
     async def on_poll_end(self, mgr: PollManager):
         now = datetime.datetime.utcnow()
@@ -280,9 +420,10 @@ class Poll(BaseCog):
         channel = self.bot.get_channel(mgr.channel_id)
         if channel is None:
             return
-        if mgr.message is None:
+        if await mgr.fetch_message() is None:
             return
-        tally = Counter(mgr.votes.values())
+        # Drop options whose votes were all withdrawn
+        tally = +mgr.tally
         if now < mgr.stop_time:
             content = 'The poll was cancelled.'
             content2 = content
@@ -246,7 +246,7 @@ can outrun it. The pupnado is soon upon him....
     async def dscore(self, ctx: commands.Context):
         """Show the puppy score"""
         deadinsky = self.deadinsky(ctx)
-        async with self.bot.sql as sql:
+        async with self.bot.sql_reader as sql:
             dead_score = await sql.get_dead_score()
             puppy_score = await sql.get_puppy_score()
 
@@ -11,6 +11,13 @@ class ReactionRoles(BaseCog):
         super().__init__(bot)
         self.reaction_schema = {}
         self.reaction_roles = collections.defaultdict(dict)
+
+    def cog_unload(self):
+        for channel_id, message_id in self.reaction_schema.values():
+            self.bot.reaction_router.unregister(message_id)
+
+    def watch(self, message_id):
+        self.bot.reaction_router.register(message_id, self.on_reaction_add, self.on_reaction_remove)
     
     async def cog_check(self, ctx):
         if not ctx.me.guild_permissions.manage_roles:
@@ -23,6 +30,7 @@ class ReactionRoles(BaseCog):
         c = await sql.execute("select * from reaction_schema")
         for guild, channel, message in await c.fetchall():
             self.reaction_schema[guild] = (channel, message)
+            self.watch(message)
         c = await sql.execute("select * from reaction_roles")
         for guild, emoji, role in await c.fetchall():
             self.reaction_roles[guild][emoji] = role
@@ -38,8 +46,7 @@ class ReactionRoles(BaseCog):
             return False
         return True
 
-    @BaseCog.listener()
-    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+    async def on_reaction_add(self, payload: discord.RawReactionActionEvent):
         if not self.validate_reaction(payload):
             return
         guild: discord.Guild = self.bot.get_guild(payload.guild_id)
@@ -47,8 +54,7 @@ class ReactionRoles(BaseCog):
         author: discord.Member = guild.get_member(payload.user_id)
         await author.add_roles(role)
 
-    @BaseCog.listener()
-    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+    async def on_reaction_remove(self, payload: discord.RawReactionActionEvent):
         if not self.validate_reaction(payload):
             return
         guild: discord.Guild = self.bot.get_guild(payload.guild_id)
@@ -66,7 +72,8 @@ class ReactionRoles(BaseCog):
         if channel.permissions_for(ctx.me).send_messages:
             message = await channel.send('React to the following emoji to get the associated roles:')
             self.reaction_schema[ctx.guild.id] = (channel.id, message.id)
-            with self.bot.sql as sql:
+            self.watch(message.id)
+            async with self.bot.sql as sql:
                 await sql.execute("insert into reaction_schema values (?, ?, ?)", (ctx.guild.id, channel.id, message.id))
             await ctx.message.add_reaction('✅')
 
@@ -80,9 +87,10 @@ class ReactionRoles(BaseCog):
         channel = ctx.guild.get_channel(channel_id)
         message = await channel.fetch_message(message_id)
         await message.delete()
+        self.bot.reaction_router.unregister(message_id)
         self.reaction_schema.pop(ctx.guild.id)
         self.reaction_roles.pop(ctx.guild.id, None)
-        with self.bot.sql as sql:
+        async with self.bot.sql as sql:
             await sql.execute("delete from reaction_schema where guild = ?", (ctx.guild.id,))
             await sql.execute("delete from reaction_roles where guild = ?", (ctx.guild.id,))
         await ctx.message.add_reaction('✅')
@@ -103,7 +111,7 @@ class ReactionRoles(BaseCog):
         if any(str(reaction.emoji) == emoji for reaction in message.reactions):
             raise ReactionAlreadyRegistered
         await message.add_reaction(emoji)
-        with self.bot.sql as sql:
+        async with self.bot.sql as sql:
             await sql.execute("insert into reaction_roles values (?, ?, ?)", (ctx.guild.id, str(emoji), role.id))
         await ctx.message.add_reaction('✅')
     
@@ -133,7 +141,7 @@ class ReactionRoles(BaseCog):
                 raise RoleOrEmojiNotFound
         self.reaction_roles[ctx.guild.id].pop(str(emoji))
         await message.remove_reaction(emoji)
-        with self.bot.sql as sql:
+        async with self.bot.sql as sql:
             await sql.execute("delete from reaction_roles where guild = ? and emoji = ?", (ctx.guild.id, str(emoji)))
         await ctx.message.add_reaction('✅')
 
@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 import discord
 from collections import defaultdict, namedtuple
@@ -32,22 +33,29 @@ class SeenUser(BaseCog):
             self.member_cache[(message.guild.id, message.author.id)] = proxy_
             self.history_cache[message.channel.id].append(proxy_)
 
+    async def cache_history(self, channel: discord.TextChannel, after: datetime.datetime):
+        history = []
+        await self.bot.history_ingest.fetch(channel, lambda message: history.append(proxy(message)), after=after)
+        # Merge with anything on_message saw while we were fetching
+        merged = {msg.message_id: msg for msg in history + self.history_cache.get(channel.id, [])}
+        self.history_cache[channel.id] = sorted(merged.values(), key=lambda msg: msg.created_at)
+
     async def get_last_seen_msg(self, member: discord.Member) -> typing.Optional[MessageProxy]:
         last = datetime.datetime.utcnow() - SeenUser.MAX_LOOKBACK
+        me = member.guild.me
+        await asyncio.gather(*(
+            self.cache_history(channel, last)
+            for channel in member.guild.text_channels
+            if channel.id not in self.history_cache and channel.permissions_for(me).read_message_history
+        ))
         seen_msg: typing.Optional[MessageProxy] = None
         for channel in member.guild.text_channels:  # type: discord.TextChannel
-            if channel.id in self.history_cache:
-                history = self.history_cache[channel.id]
-            elif channel.permissions_for(member.guild.me).read_message_history:
-                history = [proxy(message) async for message in channel.history(limit=None, after=last)]
-                if history:
-                    history.sort(key=lambda msg: msg.created_at)
-                self.history_cache[channel.id] = history
-            else:
+            history = self.history_cache.get(channel.id)
+            if not history:
                 continue
-            seen_msg = discord.utils.get(reversed(history), author_id=member.id) or seen_msg
-            if seen_msg is not None:
-                last = seen_msg.created_at
+            msg = discord.utils.get(reversed(history), author_id=member.id)
+            if msg is not None and (seen_msg is None or msg.created_at > seen_msg.created_at):
+                seen_msg = msg
         return seen_msg
 
     @commands.command()
@@ -64,7 +72,7 @@ class SeenUser(BaseCog):
             await ctx.send(f'{member.display_name} has not said anything on this server recently.')
         else:
             await ctx.send(f'{member.display_name} was last seen chatting in <#{seen_msg.channel_id}> '
-                           f'{seen_msg.created_at.strftime("on %d %B %Y at %H:%M:%S UTC")}\n{get_jump_url(seen_msg)}')
+                           f'{seen_msg.created_at.strftime("on %d %B %Y at %H:%M:%S UTC")}\n{get_jump_url(ctx, seen_msg)}')
 
 
 def setup(bot):
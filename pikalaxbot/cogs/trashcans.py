@@ -77,9 +77,7 @@ class TrashcansGame(GameBase):
     async def end(self, ctx: commands.Context, failed=False, aborted=False):
         if self.running:
             self._state = [[x for x in y] for y in self._solution]
-            if self._task and not self._task.done():
-                self._task.cancel()
-                self._task = None
+            self.cancel_timeout()
             await self._message.edit(content=self)
             if aborted:
                 await ctx.send(f'Game terminated by {ctx.author.mention}.')
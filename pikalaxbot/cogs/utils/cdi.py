@@ -0,0 +1,138 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import typing
+import numpy as np
+
+
+__all__ = ('CDIAccumulator',)
+
+
+class CDIAccumulator:
+    """Linearly weighted moving averages over the last `window` samples
+    of many series at once, one row per key.
+
+    Each row keeps its samples in a ring buffer plus two running sums:
+    the plain total S and the weighted total T, where the newest of n
+    samples has weight n and the oldest weight 1.  Pushing x onto a full
+    window evicts the oldest sample and shifts every weight down by one,
+    so T' = T - S + n * x and S' = S - oldest + x.  Until the window is
+    full, T' = T + (n + 1) * x.  The average is 2T / (n (n + 1)).
+
+    Samples are integers so that the sums stay exact; averages are
+    divided by `scale`.  The last `window` averages of each row are kept
+    as well, for plotting."""
+
+    def __init__(self, window: int, *, scale=1, capacity=64):
+        self.window = window
+        self.scale = scale
+        self.rows: typing.Dict[typing.Hashable, int] = {}
+        self.head = 0
+        self.samples = np.zeros((capacity, window), dtype=np.int64)
+        self.averages = np.zeros((capacity, window))
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.average_counts = np.zeros(capacity, dtype=np.int64)
+        self.totals = np.zeros(capacity, dtype=np.int64)
+        self.weighted = np.zeros(capacity, dtype=np.int64)
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, key) -> int:
+        """Start tracking a series, returning its row"""
+        try:
+            return self.rows[key]
+        except KeyError:
+            row = self.rows[key] = len(self.rows)
+            capacity = len(self.counts)
+            if row == capacity:
+                for attr in ('samples', 'averages', 'counts', 'average_counts', 'totals', 'weighted'):
+                    old = getattr(self, attr)
+                    new = np.zeros((2 * capacity,) + old.shape[1:], dtype=old.dtype)
+                    new[:capacity] = old
+                    setattr(self, attr, new)
+            return row
+
+    def columns(self, n: int) -> np.ndarray:
+        """Ring buffer columns of the last n pushes, oldest first"""
+        return (self.head - np.arange(n - 1, -1, -1)) % self.window
+
+    def push(self, latest: np.ndarray):
+        """Append one sample to every row.  `latest` is indexed by row."""
+        n = len(self.rows)
+        self.head = (self.head + 1) % self.window
+        counts = self.counts[:n]
+        full = counts == self.window
+        evicted = np.where(full, self.samples[:n, self.head], 0)
+        np.minimum(counts + 1, self.window, out=counts)
+        self.weighted[:n] += counts * latest - np.where(full, self.totals[:n], 0)
+        self.totals[:n] += latest - evicted
+        self.samples[:n, self.head] = latest
+        self.averages[:n, self.head] = self.current()
+        np.minimum(self.average_counts[:n] + 1, self.window, out=self.average_counts[:n])
+
+    def load(self, key, samples: typing.Sequence[int]):
+        """Replace a row with the given samples, oldest first.  The newest
+        sample lands on the current head.  Averages are recorded for every
+        full window, so at least `window` samples are needed to get any."""
+        row = self.add(key)
+        total = weighted = n = 0
+        averages = []
+        for i, x in enumerate(samples):
+            if n == self.window:
+                weighted -= total
+                total -= samples[i - n]
+            else:
+                n += 1
+            weighted += n * x
+            total += x
+            if n == self.window:
+                averages.append(2 * weighted / (n * (n + 1) * self.scale))
+        averages = averages[-self.window:]
+        self.samples[row] = 0
+        self.samples[row, self.columns(n)] = samples[len(samples) - n:]
+        self.averages[row, self.columns(len(averages))] = averages
+        self.counts[row] = n
+        self.average_counts[row] = len(averages)
+        self.totals[row] = total
+        self.weighted[row] = weighted
+
+    def current(self) -> np.ndarray:
+        """The current average of every row"""
+        n = len(self.rows)
+        counts = self.counts[:n]
+        norm = counts * (counts + 1) * self.scale
+        return np.divide(2 * self.weighted[:n], norm, out=np.zeros(n), where=norm != 0)
+
+    def count(self, key) -> int:
+        """Number of samples in the key's window"""
+        return int(self.counts[self.rows[key]])
+
+    def average(self, key) -> float:
+        """The current average of one series, in constant time"""
+        row = self.rows[key]
+        n = int(self.counts[row])
+        if n == 0:
+            return 0
+        return 2 * int(self.weighted[row]) / (n * (n + 1) * self.scale)
+
+    def history(self, key) -> np.ndarray:
+        """Recorded averages of one series, oldest first"""
+        row = self.rows[key]
+        return self.averages[row, self.columns(self.average_counts[row])]
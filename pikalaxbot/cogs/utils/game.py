@@ -39,7 +39,7 @@ def find_emoji(guild, name, case_sensitive=True):
 
 class GameBase:
     __slots__ = (
-        'bot', '_timeout', '_lock', '_max_score', '_state', '_running', '_message', '_task',
+        'bot', '_timeout', '_lock', '_max_score', '_state', '_running', '_message',
         'start_time', '_players'
     )
 
@@ -61,7 +61,6 @@ class GameBase:
         self._state = None
         self._running = False
         self._message = None
-        self._task = None
         self.start_time = -1
         self._players = set()
 
@@ -92,25 +91,22 @@ class GameBase:
         return ', '.join(player.name for player in self._players)
 
     async def timeout(self, ctx):
-        await asyncio.sleep(self._timeout)
         if self.running:
             await ctx.send('Time\'s up!')
             self.bot.loop.create_task(self.end(ctx, failed=True))
 
-    async def start(self, ctx):
-        def destroy_self(task):
-            self._task = None
+    def cancel_timeout(self):
+        self.bot.scheduler.cancel(self)
 
+    async def start(self, ctx):
         self.running = True
         self._message = await ctx.send(self)
-        self._task = self.bot.loop.create_task(self.timeout(ctx))
-        self._task.add_done_callback(destroy_self)
         self.start_time = time.time()
+        self.bot.scheduler.schedule(self, self.start_time + self._timeout, self.timeout, ctx)
 
     async def end(self, ctx, failed=False, aborted=False):
         if self.running:
-            if self._task and not self._task.done():
-                self._task.cancel()
+            self.cancel_timeout()
             return True
         return False
 
@@ -0,0 +1,115 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import datetime
+import inspect
+import discord
+
+
+__all__ = ('HistoryIngest',)
+
+
+def _snowflake(value, high):
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return discord.utils.time_snowflake(value, high=high)
+    return getattr(value, 'id', value)
+
+
+class _Subscriber:
+    __slots__ = ('callback', 'after', 'before', 'limit', 'count', 'future')
+
+    def __init__(self, callback, after, before, limit, future):
+        self.callback = callback
+        self.after = _snowflake(after, True)
+        self.before = _snowflake(before, False)
+        self.limit = limit
+        self.count = 0
+        self.future = future
+
+
+class HistoryIngest:
+    """Shared reader of channel history.
+
+    Subscribers ask for the history of a channel, bounded by `after`
+    and/or `limit`.  Requests for the same channel made within `delay`
+    seconds of each other, or while the channel waits for a free slot,
+    are served by one newest-first walk over the history.  Every message
+    is handed to each subscriber that wants it.
+
+    At most `concurrency` channels are read at once.  Message history is
+    rate limited per channel, and discord.py's HTTP client already waits
+    out each route's bucket, so reading different channels in parallel
+    does not trip the rate limits."""
+
+    def __init__(self, bot, *, concurrency=4, delay=1.0):
+        self.bot = bot
+        self.delay = delay
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._queued = {}
+
+    def fetch(self, channel: discord.TextChannel, callback, *, after=None, before=None, limit=None) -> asyncio.Future:
+        """Call `callback` (a function or coroutine function) with each message
+        in the requested window, newest first.  `after` and `before` may be
+        datetimes, snowflakes or ids.  Returns a future resolving to the number
+        of messages delivered."""
+        if after is None and limit is None:
+            raise ValueError('either after or limit is required')
+        sub = _Subscriber(callback, after, before, limit, self.bot.loop.create_future())
+        queue = self._queued.get(channel.id)
+        if queue is None:
+            queue = self._queued[channel.id] = []
+            self.bot.loop.create_task(self._run(channel, queue))
+        queue.append(sub)
+        return sub.future
+
+    async def _run(self, channel, subs):
+        await asyncio.sleep(self.delay)
+        async with self._semaphore:
+            # Later subscribers start a new walk
+            self._queued.pop(channel.id, None)
+            try:
+                await self._walk(channel, subs)
+            except Exception as e:
+                for sub in subs:
+                    if not sub.future.done():
+                        sub.future.set_exception(e)
+            else:
+                for sub in subs:
+                    if not sub.future.done():
+                        sub.future.set_result(sub.count)
+
+    async def _walk(self, channel, subs):
+        befores = [sub.before for sub in subs]
+        before = None if None in befores else discord.Object(max(befores))
+        active = list(subs)
+        async for message in channel.history(limit=None, before=before, oldest_first=False):
+            for sub in list(active):
+                if sub.after is not None and message.id <= sub.after:
+                    active.remove(sub)
+                    continue
+                if sub.before is not None and message.id >= sub.before:
+                    continue
+                result = sub.callback(message)
+                if inspect.isawaitable(result):
+                    await result
+                sub.count += 1
+                if sub.limit is not None and sub.count >= sub.limit:
+                    active.remove(sub)
+            if not active:
+                break
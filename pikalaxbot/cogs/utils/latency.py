@@ -0,0 +1,96 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import time
+import typing
+import numpy as np
+
+
+__all__ = ('LatencySketch',)
+
+
+class LatencySketch:
+    """Streaming latency quantiles in fixed memory.
+
+    Samples are counted in logarithmic buckets, HDR histogram style: a
+    bucket spans a factor of 1 + `precision`, so any quantile is reported
+    within about half that, relatively.  Counts are kept per minute for the
+    last hour and per hour for the last day, in ring buffers, so quantiles
+    can be read over any sliding window up to a day long."""
+
+    rings = (
+        (60, 60),
+        (3600, 24),
+    )
+
+    def __init__(self, *, lowest=0.1, highest=60000.0, precision=0.02):
+        self.lowest = lowest
+        self.highest = highest
+        self.log_base = math.log1p(precision)
+        self.nbuckets = int(math.ceil(math.log(highest / lowest) / self.log_base)) + 1
+        self.counts = [np.zeros((slots, self.nbuckets), dtype=np.uint32) for _, slots in self.rings]
+        self.times = [np.full(slots, -1, dtype=np.int64) for _, slots in self.rings]
+        self.total = 0
+
+    def bucket(self, value: float) -> int:
+        value = min(max(value, self.lowest), self.highest)
+        return int(math.log(value / self.lowest) / self.log_base)
+
+    def value(self, index):
+        """Midpoint of a bucket"""
+        return self.lowest * np.exp((np.asarray(index) + 0.5) * self.log_base)
+
+    def record(self, value: float, ts=None):
+        if not math.isfinite(value):
+            return
+        ts = int(time.time() if ts is None else ts)
+        index = self.bucket(value)
+        for (width, slots), counts, times in zip(self.rings, self.counts, self.times):
+            period = ts // width
+            slot = period % slots
+            if times[slot] != period:
+                times[slot] = period
+                counts[slot] = 0
+            counts[slot, index] += 1
+        self.total += 1
+
+    def histogram(self, window: float, now=None) -> np.ndarray:
+        """Bucket counts over the last `window` seconds, at the resolution
+        of the finest ring spanning the whole window"""
+        now = int(time.time() if now is None else now)
+        for (width, slots), counts, times in zip(self.rings, self.counts, self.times):
+            if window <= width * slots:
+                break
+        period = now // width
+        n = min(slots, int(math.ceil(window / width)))
+        live = (times > period - n) & (times <= period)
+        return counts[live].sum(axis=0, dtype=np.int64)
+
+    def quantiles(self, qs: typing.Sequence[float], window: float, now=None) -> typing.Tuple[int, typing.List[float]]:
+        """Number of samples in the window and the requested quantiles,
+        None if there were no samples"""
+        counts = self.histogram(window, now)
+        cumulative = np.cumsum(counts)
+        total = int(cumulative[-1])
+        if total == 0:
+            return 0, [None for _ in qs]
+        ranks = np.maximum(np.ceil(np.asarray(qs) * total), 1)
+        return total, [float(v) for v in self.value(np.searchsorted(cumulative, ranks))]
+
+    def summary(self, window: float, now=None) -> dict:
+        count, (p50, p95, p99, p100) = self.quantiles((0.5, 0.95, 0.99, 1.0), window, now)
+        return {'window': window, 'count': count, 'p50': p50, 'p95': p95, 'p99': p99, 'max': p100}
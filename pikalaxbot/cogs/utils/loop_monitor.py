@@ -0,0 +1,117 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import time
+import typing
+from pikalaxbot.utils.logging_mixin import LoggingMixin
+from .latency import LatencySketch
+
+
+__all__ = ('LoopMonitor', 'SlowCallback')
+
+
+class SlowCallback(typing.NamedTuple):
+    timestamp: float
+    duration: float
+    name: str
+    cog: typing.Optional[str]
+    location: str
+
+
+class LoopMonitor(LoggingMixin):
+    """Watches the event loop for stalls.
+
+    A sampler task sleeps for `interval` seconds at a time and records how
+    late it wakes up, in milliseconds.  While running, every callback the
+    loop runs is timed.  Those taking `slow_callback_duration` seconds or
+    more are logged along with the coroutine, and the cog if any, they
+    were running."""
+
+    def __init__(self, bot, *, interval=0.25, slow_callback_duration=0.1, lag_warning=0.5, history=20):
+        super().__init__()
+        self.bot = bot
+        self.interval = interval
+        self.slow_callback_duration = slow_callback_duration
+        self.lag_warning = lag_warning
+        self.lag = LatencySketch(lowest=0.1, highest=600000.0)
+        self.max_lag = 0.0
+        self.slow_callbacks: typing.Deque[SlowCallback] = collections.deque(maxlen=history)
+        self.slow_callback_count = 0
+        self._task = None
+        self._original_run = None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._install_hook()
+        self._task = self.bot.loop.create_task(self._sample())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._original_run is not None:
+            asyncio.events.Handle._run = self._original_run
+            self._original_run = None
+
+    async def _sample(self):
+        loop = self.bot.loop
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - start - self.interval
+            self.lag.record(lag * 1000)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.lag_warning:
+                self.log_warning(f'Event loop lagged by {lag * 1000:.0f} ms')
+
+    def _install_hook(self):
+        original_run = self._original_run = asyncio.events.Handle._run
+        monitor = self
+
+        def _run(handle):
+            start = time.perf_counter()
+            original_run(handle)
+            duration = time.perf_counter() - start
+            if duration >= monitor.slow_callback_duration:
+                monitor._report(handle, duration)
+
+        asyncio.events.Handle._run = _run
+
+    def describe(self, handle) -> typing.Tuple[str, typing.Optional[str], str]:
+        """Name, cog and source location of what a loop callback was running"""
+        callback = handle._callback
+        task = getattr(callback, '__self__', None)
+        if isinstance(task, asyncio.Task):
+            # discord.py wraps listeners, the original coroutine is the interesting one
+            callback = getattr(task, '_ClientEventTask__original_coro', None) or task.get_coro()
+        name = getattr(callback, '__qualname__', None) or repr(callback)
+        code = getattr(callback, 'cr_code', None) or getattr(callback, '__code__', None)
+        location = f'{code.co_filename}:{code.co_firstlineno}' if code is not None else ''
+        cog = name.split('.', 1)[0]
+        return name, cog if cog in self.bot.cogs else None, location
+
+    def _report(self, handle, duration):
+        try:
+            name, cog, location = self.describe(handle)
+        except Exception:
+            name, cog, location = repr(handle), None, ''
+        self.slow_callback_count += 1
+        self.slow_callbacks.append(SlowCallback(time.time(), duration, name, cog, location))
+        self.log_warning(f'Slow callback took {duration * 1000:.0f} ms: {name}'
+                         f'{f" (cog {cog})" if cog else ""} {location}')
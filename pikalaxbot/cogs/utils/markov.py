@@ -16,26 +16,38 @@
 #
 # Unapologetically aped from https://github.com/TwitchPlaysPokemon/tpp/utils/markov.py
 
+import struct
+import sys
+from array import array
+from bisect import bisect
 from collections import defaultdict, Counter
-from random import choices
+from itertools import accumulate
+from random import randrange
 
 
 class Chain:
     # tbl = { ( state0, state1, ... ): { next_obj: count, ... }, ... }
+    # cum = { state: ( [ next_obj, ... ], [ running total of counts, ... ] ) }, rebuilt lazily
     def __init__(self, state_size=2, store_lowercase=False):
         self.tbl = defaultdict(Counter)
+        self.cum = {}
         self.state_size = state_size
         self.store_lowercase = store_lowercase
 
-    @staticmethod
-    def __weighted_choice(items):
-        return choices(list(items), weights=items.values())[0]
+    def __weighted_choice(self, state):
+        try:
+            objs, cum = self.cum[state]
+        except KeyError:
+            items = self.tbl[state]
+            objs, cum = self.cum[state] = list(items), list(accumulate(items.values()))
+        return objs[bisect(cum, randrange(cum[-1]))]
 
     def __lower(self, obj):
         return str(obj).lower() if self.store_lowercase else obj
 
     def learn(self, state, obj):
         self.tbl[state][obj] += 1
+        self.cum.pop(state, None)
 
     def learn_list(self, objs):
         state = (None,) * self.state_size
@@ -48,7 +60,8 @@ class Chain:
         self.learn_list(string.split())
 
     def unlearn(self, state, obj):
-        if obj in self.tbl[state]:
+        if state in self.tbl and obj in self.tbl[state]:
+            self.cum.pop(state, None)
             self.tbl[state][obj] -= 1
             if self.tbl[state][obj] == 0:
                 self.tbl[state].pop(obj)
@@ -71,7 +84,7 @@ class Chain:
         for _ in range(max_count):
             if state not in self.tbl:
                 break
-            next_obj = self.__weighted_choice(self.tbl[state])
+            next_obj = self.__weighted_choice(state)
             if next_obj is None:
                 break
             result.append(next_obj)
@@ -80,3 +93,308 @@ class Chain:
 
     def generate_str(self, max_count=64):
         return str.join(' ', self.generate(max_count))
+
+
+class CompactChain:
+    # Same interface as Chain, with compact storage:
+    # words = [None, word1, word2, ...]; vocab = { word: index into words }
+    # states are packed into one int, `bits` bits per word id
+    # single = { state: next_id << bits | count }  (states with one successor)
+    # multi = { state: slot }; ids[slot], counts[slot] = arrays of next word ids and counts
+    # index = { slot: { next_id: position } }  (only for states with more than `wide` successors)
+    # cum = { slot: array of running totals of counts[slot] }, rebuilt lazily after learn/unlearn
+    bits = 32
+    wide = 32
+
+    def __init__(self, state_size=2, store_lowercase=False):
+        self.state_size = state_size
+        self.store_lowercase = store_lowercase
+        self.words = [None]
+        self.vocab = {None: 0}
+        self.single = {}
+        self.multi = {}
+        self.ids = []
+        self.counts = []
+        self.index = {}
+        self.cum = {}
+        self._free = []
+        self._mask = (1 << (self.bits * state_size)) - 1
+        self._count_mask = (1 << self.bits) - 1
+
+    def __len__(self):
+        return len(self.single) + len(self.multi)
+
+    def __lower(self, obj):
+        return str(obj).lower() if self.store_lowercase else obj
+
+    def __intern(self, obj):
+        try:
+            return self.vocab[obj]
+        except KeyError:
+            self.vocab[obj] = wid = len(self.words)
+            self.words.append(obj)
+            return wid
+
+    def __shift(self, key, wid):
+        return ((key << self.bits) | wid) & self._mask
+
+    def __pack(self, state):
+        key = 0
+        for obj in state:
+            key = self.__shift(key, self.__intern(obj))
+        return key
+
+    def __find(self, slot, wid):
+        index = self.index.get(slot)
+        if index is not None:
+            return index.get(wid)
+        try:
+            return self.ids[slot].index(wid)
+        except ValueError:
+            return None
+
+    def __new_slot(self, ids, counts):
+        if self._free:
+            slot = self._free.pop()
+            self.ids[slot] = ids
+            self.counts[slot] = counts
+        else:
+            slot = len(self.ids)
+            self.ids.append(ids)
+            self.counts.append(counts)
+        return slot
+
+    def _learn_id(self, key, wid):
+        slot = self.multi.get(key)
+        if slot is None:
+            packed = self.single.get(key)
+            if packed is None:
+                self.single[key] = (wid << self.bits) | 1
+            elif packed >> self.bits == wid:
+                self.single[key] = packed + 1
+            else:
+                del self.single[key]
+                ids = array('I', (packed >> self.bits, wid))
+                counts = array('I', (packed & self._count_mask, 1))
+                self.multi[key] = self.__new_slot(ids, counts)
+            return
+        self.cum.pop(slot, None)
+        i = self.__find(slot, wid)
+        if i is not None:
+            self.counts[slot][i] += 1
+            return
+        ids = self.ids[slot]
+        ids.append(wid)
+        self.counts[slot].append(1)
+        index = self.index.get(slot)
+        if index is not None:
+            index[wid] = len(ids) - 1
+        elif len(ids) > self.wide:
+            self.index[slot] = {w: j for j, w in enumerate(ids)}
+
+    def _unlearn_id(self, key, wid):
+        slot = self.multi.get(key)
+        if slot is None:
+            packed = self.single.get(key)
+            if packed is not None and packed >> self.bits == wid:
+                if packed & self._count_mask == 1:
+                    del self.single[key]
+                else:
+                    self.single[key] = packed - 1
+            return
+        i = self.__find(slot, wid)
+        if i is None:
+            return
+        self.cum.pop(slot, None)
+        ids = self.ids[slot]
+        counts = self.counts[slot]
+        counts[i] -= 1
+        if counts[i]:
+            return
+        # Swap the last successor into the vacated position
+        index = self.index.get(slot)
+        last = len(ids) - 1
+        if i != last:
+            ids[i] = ids[last]
+            counts[i] = counts[last]
+            if index is not None:
+                index[ids[i]] = i
+        ids.pop()
+        counts.pop()
+        if index is not None:
+            del index[wid]
+            if len(ids) <= self.wide:
+                del self.index[slot]
+        if len(ids) == 1:
+            del self.multi[key]
+            self.single[key] = (ids[0] << self.bits) | counts[0]
+            self.ids[slot] = self.counts[slot] = None
+            self._free.append(slot)
+
+    def learn(self, state, obj):
+        self._learn_id(self.__pack(state), self.__intern(obj))
+
+    def learn_list(self, objs):
+        key = 0
+        for obj in objs:
+            self._learn_id(key, self.__intern(obj))
+            key = self.__shift(key, self.__intern(self.__lower(obj)))
+        self._learn_id(key, 0)
+
+    def learn_str(self, string):
+        self.learn_list(string.split())
+
+    def unlearn(self, state, obj):
+        if obj in self.vocab and all(o in self.vocab for o in state):
+            self._unlearn_id(self.__pack(state), self.vocab[obj])
+
+    def unlearn_list(self, objs):
+        key = 0
+        for obj in objs:
+            wid = self.vocab.get(obj)
+            lower = self.vocab.get(self.__lower(obj))
+            if wid is None or lower is None:
+                return
+            self._unlearn_id(key, wid)
+            key = self.__shift(key, lower)
+        self._unlearn_id(key, 0)
+
+    def unlearn_str(self, string):
+        self.unlearn_list(string.split())
+
+    def _next_id(self, key):
+        slot = self.multi.get(key)
+        if slot is not None:
+            cum = self.cum.get(slot)
+            if cum is None:
+                cum = self.cum[slot] = array('L', accumulate(self.counts[slot]))
+            return self.ids[slot][bisect(cum, randrange(cum[-1]))]
+        packed = self.single.get(key)
+        if packed is not None:
+            return packed >> self.bits
+
+    def generate(self, max_count=64):
+        result = []
+        key = 0
+        for _ in range(max_count):
+            wid = self._next_id(key)
+            if not wid:
+                break
+            obj = self.words[wid]
+            result.append(obj)
+            key = self.__shift(key, self.vocab[self.__lower(obj)])
+        return result
+
+    def generate_str(self, max_count=64):
+        return str.join(' ', self.generate(max_count))
+
+
+# Snapshot format (native arrays stored little-endian, every section 8-byte aligned so it can be mapped):
+# header: magic, version, state_size, store_lowercase, bits, reserved
+# then sections, each a u64 byte length followed by the data and padding:
+#   channel ids (Q), high-water message ids (Q),
+#   word lengths (I), utf-8 word blob (words[1:]),
+#   single keys (Q), single values (Q),
+#   multi keys (Q), multi offsets (Q, len(multi) + 1), successor ids (I), counts (I),
+#   stored message lengths (I), utf-8 message blob
+SNAPSHOT_MAGIC = b'PKMC'
+SNAPSHOT_VERSION = 1
+_header = struct.Struct('<4sIIIII')
+_length = struct.Struct('<Q')
+
+
+def _section(chunks, data):
+    if isinstance(data, array):
+        if sys.byteorder != 'little':
+            data = array(data.typecode, data)
+            data.byteswap()
+        data = data.tobytes()
+    chunks.append(_length.pack(len(data)))
+    chunks.append(data)
+    chunks.append(b'\0' * (-len(data) % 8))
+
+
+def _strings(chunks, strings):
+    encoded = [s.encode('utf-8', 'surrogatepass') for s in strings]
+    _section(chunks, array('I', map(len, encoded)))
+    _section(chunks, b''.join(encoded))
+
+
+def dump_snapshot(chain: CompactChain, high_water: dict, messages=()) -> bytes:
+    """Serialize the chain, the last learned message id of each channel
+    and the set of learned messages."""
+    if chain.bits * chain.state_size > 64:
+        raise ValueError('states do not fit in 64 bits')
+    chunks = [_header.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, chain.state_size, chain.store_lowercase, chain.bits, 0)]
+    _section(chunks, array('Q', high_water.keys()))
+    _section(chunks, array('Q', high_water.values()))
+    _strings(chunks, chain.words[1:])
+    _section(chunks, array('Q', chain.single.keys()))
+    _section(chunks, array('Q', chain.single.values()))
+    keys = array('Q')
+    offsets = array('Q', [0])
+    ids = array('I')
+    counts = array('I')
+    for key, slot in chain.multi.items():
+        keys.append(key)
+        ids.extend(chain.ids[slot])
+        counts.extend(chain.counts[slot])
+        offsets.append(len(ids))
+    for section in (keys, offsets, ids, counts):
+        _section(chunks, section)
+    _strings(chunks, messages)
+    return b''.join(chunks)
+
+
+def load_snapshot(buffer):
+    """Inverse of :func:dump_snapshot.  Accepts any buffer, e.g. an mmap.
+    Returns (chain, high_water, messages)."""
+    view = memoryview(buffer)
+    magic, version, state_size, store_lowercase, bits, _ = _header.unpack_from(view)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError('not a Markov snapshot, or an unsupported version')
+    offset = _header.size
+
+    def section(typecode=None):
+        nonlocal offset
+        size, = _length.unpack_from(view, offset)
+        offset += _length.size
+        if offset + size > len(view):
+            raise ValueError('truncated Markov snapshot')
+        data = view[offset:offset + size]
+        offset += size + (-size % 8)
+        if typecode is None:
+            return data
+        arr = array(typecode)
+        arr.frombytes(data)
+        if sys.byteorder != 'little':
+            arr.byteswap()
+        return arr
+
+    def strings():
+        lengths = section('I')
+        blob = bytes(section())
+        result = []
+        pos = 0
+        for n in lengths:
+            result.append(blob[pos:pos + n].decode('utf-8', 'surrogatepass'))
+            pos += n
+        return result
+
+    high_water = dict(zip(section('Q'), section('Q')))
+    chain = CompactChain(state_size, bool(store_lowercase))
+    if bits != chain.bits:
+        raise ValueError(f'snapshot uses {bits}-bit word ids')
+    for word in strings():
+        chain.vocab[word] = len(chain.words)
+        chain.words.append(word)
+    chain.single = dict(zip(section('Q'), section('Q')))
+    keys, offsets, ids, counts = section('Q'), section('Q'), section('I'), section('I')
+    for slot, key in enumerate(keys):
+        start, end = offsets[slot], offsets[slot + 1]
+        chain.multi[key] = slot
+        chain.ids.append(ids[start:end])
+        chain.counts.append(counts[start:end])
+        if end - start > chain.wide:
+            chain.index[slot] = {wid: i for i, wid in enumerate(chain.ids[slot])}
+    return chain, high_water, strings()
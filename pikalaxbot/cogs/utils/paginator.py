@@ -67,6 +67,7 @@ class Pages:
         self.embed = discord.Embed(colour=discord.Colour.blurple())
         self.paginating = len(entries) > per_page
         self.show_entry_count = show_entry_count
+        self._reaction = None
         self.reaction_emojis = [
             ('\N{BLACK LEFT-POINTING DOUBLE TRIANGLE WITH VERTICAL BAR}', self.first_page),
             ('\N{BLACK LEFT-POINTING TRIANGLE}', self.previous_page),
@@ -140,6 +141,7 @@ class Pages:
             return
 
         self.message = await self.channel.send(content=content, embed=embed)
+        self.bot.reaction_router.register(self.message.id, self.on_reaction, self.on_reaction)
         for (reaction, _) in self.reaction_emojis:
             if self.maximum_pages == 2 and reaction in ('\u23ed', '\u23ee'):
                 # no |<< or >>| buttons if we only have two pages
@@ -241,6 +243,10 @@ class Pages:
                 return True
         return False
 
+    async def on_reaction(self, payload):
+        if self._reaction is not None and not self._reaction.done() and self.react_check(payload):
+            self._reaction.set_result(payload)
+
     async def paginate(self):
         """Actually paginate the entries and run the interactive loop if necessary."""
         first_page = self.show_page(1, first=True)
@@ -250,24 +256,27 @@ class Pages:
             # allow us to react to reactions right away if we're paginating
             self.bot.loop.create_task(first_page)
 
-        while self.paginating:
-            try:
-                tasks = [self.bot.wait_for(f'raw_reaction_{event}', check=self.react_check) for event in ('add', 'remove')]
-                done, left = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED, timeout=120.0)
-                [task.cancel() for task in left]
-                payload: discord.RawReactionActionEvent = done.pop().result()
-            except (asyncio.TimeoutError, IndexError, KeyError):
-                self.paginating = False
-                if self.has_manage_messages:
-                    await self.message.clear_reactions()
-            else:
-                if self.has_manage_messages:
-                    try:
-                        await self.bot.http.remove_reaction(payload.channel_id, payload.message_id, payload.emoji, payload.user_id)
-                    except:
-                        pass
-
-                await self.match()
+        try:
+            while self.paginating:
+                self._reaction = self.bot.loop.create_future()
+                try:
+                    payload: discord.RawReactionActionEvent = await asyncio.wait_for(self._reaction, 120.0)
+                except asyncio.TimeoutError:
+                    self.paginating = False
+                    if self.has_manage_messages:
+                        await self.message.clear_reactions()
+                else:
+                    if self.has_manage_messages:
+                        try:
+                            await self.bot.http.remove_reaction(payload.channel_id, payload.message_id, payload.emoji, payload.user_id)
+                        except:
+                            pass
+
+                    await self.match()
+        finally:
+            self._reaction = None
+            if self.message is not None:
+                self.bot.reaction_router.unregister(self.message.id)
 
 
 class FieldPages(Pages):
@@ -0,0 +1,131 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import collections
+import io
+import multiprocessing
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+__all__ = ('PlotSpec', 'PlotRenderer')
+
+
+class PlotSpec:
+    """A figure described as a list of Axes method calls.
+
+    Call Axes methods on the spec as if it were the Axes, e.g.
+    `spec.plot(x, y, label='foo')` or `spec.set_xlabel('Time')`.  The calls
+    are recorded and replayed by a rendering worker, so their arguments
+    must be picklable."""
+
+    def __init__(self, *, legend=False, autofmt_xdate=False, tight_layout=False):
+        self.calls = []
+        self.legend = legend
+        self.autofmt_xdate = autofmt_xdate
+        self.tight_layout = tight_layout
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+        return record
+
+
+def render(spec: PlotSpec) -> bytes:
+    """Draw the spec to PNG bytes with the object-oriented Agg API.
+    Runs in a worker process."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    for name, args, kwargs in spec.calls:
+        getattr(ax, name)(*args, **kwargs)
+    if spec.legend:
+        ax.legend(loc=0)
+    if spec.autofmt_xdate:
+        fig.autofmt_xdate(rotation=45, ha='right')
+    if spec.tight_layout:
+        fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+class PlotRenderer:
+    """Renders charts in a small pool of worker processes.
+
+    Rendering runs outside the bot's process, so it neither competes with
+    the event loop for the GIL nor shares pyplot's global state.  Results
+    are cached by key: a key should name the series and window plotted
+    and the timestamp of the newest sample, so that it changes exactly
+    when the picture would.  Concurrent requests for the same key share
+    one render."""
+
+    def __init__(self, *, workers=2, cache_size=32, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self.workers = workers
+        self.cache_size = cache_size
+        self._executor = None
+        self._cache: typing.MutableMapping[typing.Hashable, asyncio.Future] = collections.OrderedDict()
+        self.renders = 0
+        self.hits = 0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            # Forking a process with a running event loop and database
+            # threads is unsafe, so start the workers fresh
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    async def render(self, key: typing.Hashable, build: typing.Callable[[], PlotSpec]) -> bytes:
+        """PNG bytes of the chart for `key`.  `build` is only called, in the
+        event loop, when the chart is not cached."""
+        fut = self._cache.get(key)
+        if fut is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return await asyncio.shield(fut)
+        spec = build()
+        fut = self._cache[key] = self._loop.create_task(self._render(spec))
+        self.renders += 1
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        try:
+            return await asyncio.shield(fut)
+        except Exception:
+            if self._cache.get(key) is fut:
+                del self._cache[key]
+            raise
+
+    async def _render(self, spec):
+        try:
+            return await self._loop.run_in_executor(self.executor, render, spec)
+        except BrokenProcessPool:
+            self._executor = None
+            raise
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,59 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import typing
+import discord
+
+
+__all__ = ('ReactionRouter',)
+
+
+ReactionHandler = typing.Callable[[discord.RawReactionActionEvent], typing.Awaitable[None]]
+
+
+class ReactionRouter:
+    """Routes raw reaction events to whatever owns the message reacted to.
+
+    The bot listens for raw reaction events once, here.  Polls, paginators
+    and role menus register the id of the message they watch, so each
+    event costs one dict lookup however many of them are live."""
+
+    def __init__(self):
+        self._handlers: typing.Dict[int, typing.Tuple[typing.Optional[ReactionHandler], typing.Optional[ReactionHandler]]] = {}
+
+    def __contains__(self, message_id):
+        return message_id in self._handlers
+
+    def __len__(self):
+        return len(self._handlers)
+
+    def register(self, message_id: int, on_add: ReactionHandler = None, on_remove: ReactionHandler = None):
+        """Send reactions added to and removed from the message to the given
+        coroutine functions.  Replaces any handlers already registered."""
+        self._handlers[message_id] = on_add, on_remove
+
+    def unregister(self, message_id: int):
+        self._handlers.pop(message_id, None)
+
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        on_add, _ = self._handlers.get(payload.message_id, (None, None))
+        if on_add is not None:
+            await on_add(payload)
+
+    async def on_raw_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        _, on_remove = self._handlers.get(payload.message_id, (None, None))
+        if on_remove is not None:
+            await on_remove(payload)
@@ -0,0 +1,123 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import typing
+import numpy as np
+
+
+__all__ = ('RollupSeries', 'Rollup')
+
+
+class Rollup(typing.NamedTuple):
+    step: int
+    raw: bool
+    times: np.ndarray
+    mins: np.ndarray
+    means: np.ndarray
+    maxs: np.ndarray
+
+
+class _Tier:
+    __slots__ = ('step', 'capacity', 'times', 'mins', 'sums', 'maxs', 'counts', 'head', 'size')
+
+    def __init__(self, step, span, columns, dtype):
+        self.step = step
+        self.capacity = span // step
+        self.times = np.zeros(self.capacity, dtype=np.int64)
+        self.mins = np.zeros((self.capacity, columns), dtype=dtype)
+        self.sums = np.zeros((self.capacity, columns), dtype=np.float64)
+        self.maxs = np.zeros((self.capacity, columns), dtype=dtype)
+        self.counts = np.zeros(self.capacity, dtype=np.int32)
+        self.head = -1
+        self.size = 0
+
+    def add(self, ts, values):
+        bucket = int(ts) // self.step * self.step
+        if self.size and bucket <= self.times[self.head]:
+            if bucket < self.times[self.head]:
+                # Out of order, too late to fold into its bucket
+                return
+            i = self.head
+            np.minimum(self.mins[i], values, out=self.mins[i])
+            np.maximum(self.maxs[i], values, out=self.maxs[i])
+            self.sums[i] += values
+            self.counts[i] += 1
+        else:
+            i = self.head = (self.head + 1) % self.capacity
+            self.size = min(self.size + 1, self.capacity)
+            self.times[i] = bucket
+            self.mins[i] = self.maxs[i] = self.sums[i] = values
+            self.counts[i] = 1
+
+    def oldest(self):
+        return self.times[(self.head - self.size + 1) % self.capacity]
+
+    def select(self, since, raw=False):
+        order = (self.head - np.arange(self.size - 1, -1, -1)) % self.capacity
+        order = order[self.times[order] >= since]
+        return Rollup(
+            self.step,
+            raw,
+            self.times[order],
+            self.mins[order],
+            self.sums[order] / self.counts[order, None],
+            self.maxs[order]
+        )
+
+
+class RollupSeries:
+    """A multi-column time series with bounded memory.
+
+    Every sample is folded into each tier: fixed-size ring buffers of
+    buckets `step` seconds wide which keep the min, mean and max of each
+    column.  With the default tiers, raw 30 s samples are kept for 6 hours,
+    5 minute rollups for 7 days and hourly rollups for 90 days."""
+
+    default_tiers = (
+        (30, 6 * 3600),
+        (300, 7 * 86400),
+        (3600, 90 * 86400),
+    )
+
+    def __init__(self, columns: int, *, tiers=default_tiers, dtype=np.float32):
+        self.columns = columns
+        self.tiers = [_Tier(step, span, columns, dtype) for step, span in tiers]
+        # Timestamp of the newest sample
+        self.last = None
+
+    def __len__(self):
+        return self.tiers[-1].size
+
+    def append(self, ts, values):
+        values = np.asarray(values, dtype=np.float64)
+        for tier in self.tiers:
+            tier.add(ts, values)
+        self.last = ts if self.last is None else max(self.last, ts)
+
+    @property
+    def start(self) -> typing.Optional[int]:
+        """Timestamp of the oldest bucket retained"""
+        tier = self.tiers[-1]
+        return int(tier.oldest()) if tier.size else None
+
+    def select(self, since=0) -> Rollup:
+        """Samples from `since` on, at the finest resolution which still
+        covers the whole span"""
+        for tier in self.tiers:
+            # A tier which has not wrapped yet holds the whole history
+            if tier.size < tier.capacity or tier.oldest() <= since:
+                return tier.select(since, tier is self.tiers[0])
+        return self.tiers[-1].select(since)
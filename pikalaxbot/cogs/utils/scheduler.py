@@ -0,0 +1,182 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import heapq
+import itertools
+import json
+import time
+import typing
+from pikalaxbot.utils.logging_mixin import LoggingMixin
+
+
+__all__ = ('Scheduler', 'Deadline')
+
+
+class Deadline(typing.NamedTuple):
+    key: typing.Hashable
+    when: float
+    seq: int
+    callback: typing.Optional[typing.Callable]
+    args: tuple
+    # Name of the bot event to dispatch, for persistent deadlines
+    event: typing.Optional[str]
+
+
+class Scheduler(LoggingMixin):
+    """One heap of deadlines, keyed, driven by a single task.
+
+    `schedule` runs a callback at a unix timestamp; a coroutine it returns
+    is run as a task.  `schedule_event` instead dispatches a bot event with
+    JSON-serializable arguments, and is saved to the database so that it
+    still fires if the bot restarts first.  Scheduling an existing key
+    replaces it.  Cancelled and replaced deadlines are skipped lazily when
+    they reach the top of the heap."""
+
+    def __init__(self, bot):
+        super().__init__()
+        self.bot = bot
+        self._heap: typing.List[typing.Tuple[float, int, typing.Hashable]] = []
+        self._deadlines: typing.Dict[typing.Hashable, Deadline] = {}
+        self._counter = itertools.count()
+        self._wake = None
+        self._task = None
+        self._last_write = None
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    async def init_db(self, sql):
+        await sql.execute("create table if not exists scheduled_events ("
+                          "key text not null primary key, "
+                          "deadline real not null, "
+                          "event text not null, "
+                          "args text not null"
+                          ") without rowid")
+        for key, when, event, args in await sql.execute_fetchall('select * from scheduled_events'):
+            if key not in self._deadlines:
+                self._push(key, when, None, tuple(json.loads(args)), event)
+
+    def start(self):
+        if self._task is None:
+            self._task = self.bot.loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def schedule(self, key: typing.Hashable, when: float, callback: typing.Callable, *args):
+        """Call `callback(*args)` at unix time `when`"""
+        self._forget(key)
+        self._push(key, when, callback, args, None)
+
+    def schedule_event(self, key: str, when: float, event: str, *args):
+        """Dispatch `event` with `args` at unix time `when`, even across restarts"""
+        self._deadlines.pop(key, None)
+        self._push(key, when, None, args, event)
+        self._persist('replace into scheduled_events values (?, ?, ?, ?)', (key, when, event, json.dumps(args)))
+
+    def reschedule(self, key: typing.Hashable, when: float) -> bool:
+        """Move a pending deadline.  False if there was none."""
+        deadline = self._deadlines.get(key)
+        if deadline is None:
+            return False
+        self._push(key, when, deadline.callback, deadline.args, deadline.event)
+        if deadline.event is not None:
+            self._persist('update scheduled_events set deadline = ? where key = ?', (when, key))
+        return True
+
+    def cancel(self, key: typing.Hashable) -> bool:
+        """Drop a pending deadline.  False if there was none."""
+        return self._forget(key) is not None
+
+    def when(self, key: typing.Hashable) -> typing.Optional[float]:
+        deadline = self._deadlines.get(key)
+        return deadline.when if deadline is not None else None
+
+    def pending(self) -> typing.List[Deadline]:
+        """All pending deadlines, soonest first"""
+        return sorted(self._deadlines.values(), key=lambda d: (d.when, d.seq))
+
+    def _push(self, key, when, callback, args, event):
+        deadline = self._deadlines[key] = Deadline(key, when, next(self._counter), callback, args, event)
+        heapq.heappush(self._heap, (when, deadline.seq, key))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            # Mostly stale entries, rebuild rather than let it grow
+            self._heap = [(d.when, d.seq, d.key) for d in self._deadlines.values()]
+            heapq.heapify(self._heap)
+        if self._heap[0][1] == deadline.seq:
+            self._wakeup()
+
+    def _forget(self, key):
+        deadline = self._deadlines.pop(key, None)
+        if deadline is not None and deadline.event is not None:
+            self._persist('delete from scheduled_events where key = ?', (key,))
+        return deadline
+
+    def _persist(self, statement, args):
+        # Writes are chained so that they land in the order they were made
+        previous = self._last_write
+
+        async def write():
+            if previous is not None:
+                await asyncio.wait([previous])
+            async with self.bot.sql as sql:
+                await sql.execute(statement, args)
+
+        self._last_write = self.bot.loop.create_task(write())
+
+    def _wakeup(self):
+        if self._wake is not None and not self._wake.done():
+            self._wake.set_result(None)
+
+    async def _run(self):
+        loop = self.bot.loop
+        # Persistent events are for cogs, which are not listening until then
+        await self.bot.wait_until_ready()
+        while True:
+            self._wake = loop.create_future()
+            handle = None
+            if self._heap:
+                handle = loop.call_later(max(self._heap[0][0] - time.time(), 0), self._wakeup)
+            try:
+                await self._wake
+            finally:
+                if handle is not None:
+                    handle.cancel()
+            self._fire_due()
+
+    def _fire_due(self):
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            when, seq, key = heapq.heappop(self._heap)
+            deadline = self._deadlines.get(key)
+            if deadline is None or deadline.seq != seq:
+                continue
+            self._forget(key)
+            try:
+                if deadline.event is not None:
+                    self.bot.dispatch(deadline.event, *deadline.args)
+                else:
+                    result = deadline.callback(*deadline.args)
+                    if asyncio.iscoroutine(result):
+                        self.bot.loop.create_task(result)
+            except Exception:
+                self.log_error('Ignoring exception in scheduled callback %r', key, exc_info=True)
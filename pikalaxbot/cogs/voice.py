@@ -44,6 +44,7 @@ def voice_client_not_playing(ctx):
 
 
 async def voice_cmd_ensure_connected(ctx):
+    await ctx.cog.ensure_audio()
     vc: discord.VoiceClient = ctx.voice_client
     if vc is None or not vc.is_connected():
         if ctx.author.voice is None:
@@ -101,40 +102,55 @@ class Voice(BaseCog):
 
     def __init__(self, bot):
         super().__init__(bot)
-        self.load_opus()
-
-        with open(os.devnull, 'w') as DEVNULL:
+        self.ffmpeg = None
+        self._audio_lock = asyncio.Lock()
+
+    async def ensure_audio(self):
+        """Load opus and find ffmpeg the first time a voice command is used"""
+        if self.ffmpeg is not None:
+            return
+        async with self._audio_lock:
+            if self.ffmpeg is not None:
+                return
+            # Looking up the library spawns processes of its own
+            await self.bot.loop.run_in_executor(None, self.load_opus)
             for executable in ('ffmpeg', 'avconv'):
                 try:
-                    subprocess.run([executable, '-h'], stdout=DEVNULL, stderr=DEVNULL, check=True)
+                    proc = await asyncio.create_subprocess_exec(
+                        executable, '-h',
+                        stdout=asyncio.subprocess.DEVNULL,
+                        stderr=asyncio.subprocess.DEVNULL
+                    )
                 except FileNotFoundError:
                     continue
+                if await proc.wait() != 0:
+                    continue
                 self.ffmpeg = executable
                 self.__ffmpeg_options['executable'] = executable
                 break
             else:
-                raise discord.ClientException('ffmpeg or avconv not installed')
-        self.timeout_tasks = {}
+                raise VoiceCommandError('ffmpeg or avconv not installed')
+
+    IDLE_TIMEOUT = 600
 
     @staticmethod
     async def idle_timeout(ctx):
-        await asyncio.sleep(600)
-        await ctx.voice_client.disconnect()
+        if ctx.voice_client is not None:
+            await ctx.voice_client.disconnect()
 
     def start_timeout(self, ctx):
-        def done(unused):
-            self.timeout_tasks.pop(ctx.guild.id, None)
-
-        task = self.bot.loop.create_task(Voice.idle_timeout(ctx))
-        task.add_done_callback(done)
-        self.timeout_tasks[ctx.guild.id] = task
+        self.bot.scheduler.schedule(('voice-idle', ctx.guild.id), time.time() + Voice.IDLE_TIMEOUT, Voice.idle_timeout, ctx)
 
-    def player_after(self, ctx, exc):
+    def player_finished(self, ctx, exc):
         if exc:
             ctx.bot.dispatch('command_error', ctx, exc)
             print(f'Player error: {exc}')
         self.start_timeout(ctx)
 
+    def player_after(self, ctx, exc):
+        # Called on the audio player's thread
+        self.bot.loop.call_soon_threadsafe(self.player_finished, ctx, exc)
+
     def load_opus(self):
         if not discord.opus.is_loaded():
             opus_name = ctypes.util.find_library('libopus')
@@ -234,9 +250,7 @@ class Voice(BaseCog):
     @say.before_invoke
     @pikasay.before_invoke
     async def voice_cmd_cancel_timeout(self, ctx: commands.Context):
-        task = self.timeout_tasks.get(ctx.guild.id)
-        if task is not None:
-            task.cancel()
+        self.bot.scheduler.cancel(('voice-idle', ctx.guild.id))
 
 
 def setup(bot):
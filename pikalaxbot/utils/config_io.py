@@ -18,6 +18,7 @@ import asyncio
 import json
 import aiofile
 import functools
+import logging
 import os
 
 __all__ = ('Settings',)
@@ -49,15 +50,40 @@ _defaults = {
     'error_emoji': 'pikalaOwO',
     'exc_channel': 657960851193724960,
     'banned_guilds': [],
+    'sql_storage': {
+        'journal_mode': 'wal',
+        'synchronous': 'normal',
+        'cache_size': -8192,
+        'mmap_size': 67108864,
+        'temp_store': 'memory',
+        'checkpoint_mode': 'passive',
+        'checkpoint_interval': 300,
+        'checkpoint_wal_size': 4194304
+    },
 }
 
 
 class Settings(dict):
+    """The bot's settings, backed by a JSON file.
+
+    Changes are tracked per key and written back by a single debounced,
+    atomic save (temp file + rename) `save_delay` seconds after the last
+    change.  Edits made to the file by hand are picked up by a background
+    watcher polling its mtime every `watch_interval` seconds.  Each reload
+    bumps :attr:generation so that consumers can tell when to refresh."""
+
+    save_delay = 2.0
+    watch_interval = 5.0
+
     def __init__(self, fname='settings.json', *, loop=None):
         super().__init__(**_defaults)
         self._fname = fname
         self._loop = loop or asyncio.get_event_loop()
-        self._changed = False
+        self._dirty = set()
+        self._generation = 0
+        self._save_handle = None
+        self._save_task = None
+        self._watch_task = None
         self._lock = asyncio.Lock()
         try:
             with open(fname) as fp:
@@ -70,28 +96,101 @@ class Settings(dict):
             raise ValueError(f'Please set your bot\'s token in {fname}')
         self._mtime = os.path.getmtime(fname)
 
+    @property
+    def generation(self):
+        return self._generation
+
     async def __aenter__(self):
         await self._lock.acquire()
-        if os.path.getmtime(self._fname) > self._mtime:
-            async with aiofile.AIOFile(self._filename) as fp:
-                t = await fp.read()
-            data = await self._loop.run_in_executor(None, json.loads, t)
-            await self._loop.run_in_executor(None, self.update, data)
-            self._mtime = os.path.getmtime(self._fname)
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         try:
-            if self._changed:
-                partial = functools.partial(json.dumps, self, indent=4, separators=(', ', ': '))
-                s = await self._loop.run_in_executor(None, partial)
-                async with aiofile.AIOFile(self._filename, 'w') as fp:
-                    await fp.write(s)
-                self._changed = False
-                self._mtime = os.path.getmtime(self._fname)
+            if self._dirty:
+                self._schedule_save()
         finally:
             self._lock.release()
 
+    def _schedule_save(self):
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+
+        async def save():
+            try:
+                await self.save()
+            except OSError:
+                # The keys were put back, try again later
+                logging.getLogger('discord').exception(f'Failed to save {self._fname}')
+                self._schedule_save()
+
+        def start():
+            self._save_handle = None
+            self._save_task = self._loop.create_task(save())
+
+        self._save_handle = self._loop.call_later(self.save_delay, start)
+
+    def _write(self, s):
+        tmpname = f'{self._fname}.tmp'
+        with open(tmpname, 'w') as fp:
+            fp.write(s)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmpname, self._fname)
+        return os.path.getmtime(self._fname)
+
+    async def save(self):
+        """Write pending changes to the settings file."""
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        async with self._lock:
+            if not self._dirty:
+                return
+            # Keys changed from here on are saved next time
+            dirty, self._dirty = self._dirty, set()
+            try:
+                partial = functools.partial(json.dumps, self, indent=4, separators=(', ', ': '))
+                s = await self._loop.run_in_executor(None, partial)
+                self._mtime = await self._loop.run_in_executor(None, self._write, s)
+            except Exception:
+                self._dirty |= dirty
+                raise
+
+    async def reload(self):
+        """Re-read the settings file if it was modified externally.
+        Keys with unsaved local changes are kept."""
+        mtime = os.path.getmtime(self._fname)
+        if mtime <= self._mtime:
+            return False
+        async with self._lock:
+            async with aiofile.AIOFile(self._fname) as fp:
+                t = await fp.read()
+            data = await self._loop.run_in_executor(None, json.loads, t)
+            for key in self._dirty:
+                data.pop(key, None)
+            self.update(data)
+            self._mtime = mtime
+            self._generation += 1
+        return True
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            try:
+                await self.reload()
+            except (OSError, ValueError):
+                continue
+
+    def start_watching(self):
+        if self._watch_task is None:
+            self._watch_task = self._loop.create_task(self.watch())
+
+    async def close(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+        await self.save()
+
     def __getattr__(self, item):
         return self.get(item)
 
@@ -100,4 +199,4 @@ class Settings(dict):
             super().__setattr__(key, value)
         elif key not in self or self[key] != value:
             self[key] = value
-            self._changed = True
+            self._dirty.add(key)
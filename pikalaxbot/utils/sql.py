@@ -18,8 +18,18 @@ import aiosqlite
 import sqlite3
 import asyncio
 import glob
+import logging
+import os
 import shutil
 import time
+from collections import Counter
+
+
+__all__ = ('Sql', 'CounterBuffer', 'SqlLease', 'SqlPool', 'connect')
+
+_score_upsert = "insert into game (id, name, score) values (?, ?, ?) " \
+                "on conflict (id) do update set name = excluded.name, score = score + excluded.score"
+_puppy_update = "update puppy set uranium = uranium + ?, score_puppy = score_puppy + ?, score_dead = score_dead + ?"
 
 
 class Sql(aiosqlite.Connection):
@@ -29,6 +39,7 @@ class Sql(aiosqlite.Connection):
         ('turned away!',),
         ('let out a cry in protest!',)
     )
+    counters = None
 
     def __init__(self, database, *, loop=None, **kwargs):
         def connector():
@@ -46,6 +57,28 @@ class Sql(aiosqlite.Connection):
         for cog in bot.cogs.values():
             await cog.init_db(self)
 
+    async def migrate(self, name, migrations):
+        """Bring the tables owned by `name` up to date.
+
+        `migrations` is a sequence of coroutine functions taking this
+        connection, in the order they were written.  The number already
+        applied is recorded in `schema_versions`; each remaining one runs
+        in its own transaction together with its version bump."""
+        await self.execute("create table if not exists schema_versions (name text not null primary key, version integer not null) without rowid")
+        rows = await self.execute_fetchall("select version from schema_versions where name = ?", (name,))
+        version = rows[0][0] if rows else 0
+        for version, migration in enumerate(migrations[version:], version + 1):
+            await self.commit()
+            await self.execute("begin")
+            try:
+                await migration(self)
+                await self.execute("replace into schema_versions values (?, ?)", (name, version))
+            except Exception:
+                await self.rollback()
+                raise
+            await self.commit()
+        return version
+
     async def db_clear(self):
         await self.execute("drop table if exists meme")
         await self.execute("drop table if exists game")
@@ -54,11 +87,25 @@ class Sql(aiosqlite.Connection):
         await self.execute("drop table if exists prefixes")
 
     async def increment_score(self, player, by=1):
-        await self.execute("replace into game values (?, ?, ?)", (player.id, player.name, by))
+        if self.counters is not None:
+            self.counters.add_score(player.id, player.name, by)
+        else:
+            await self.execute(_score_upsert, (player.id, player.name, by))
 
     async def get_all_scores(self):
-        c = await self.execute("select * from game order by score desc limit 10")
-        for row in await c.fetchall():
+        pending = self.counters.pending_scores() if self.counters is not None else {}
+        rows = await self.execute_fetchall("select * from game order by score desc limit ?", (10 + len(pending),))
+        if pending:
+            scores = {_id: [name, score] for _id, name, score in rows}
+            missing = [_id for _id in pending if _id not in scores]
+            if missing:
+                params = ', '.join('?' * len(missing))
+                for _id, name, score in await self.execute_fetchall(f"select * from game where id in ({params})", missing):
+                    scores[_id] = [name, score]
+            for _id, (name, by) in pending.items():
+                scores.setdefault(_id, [name, 0])[1] += by
+            rows = sorted(((_id, name, score) for _id, (name, score) in scores.items()), key=lambda row: -row[2])
+        for row in rows[:10]:
             yield row
 
     async def add_bag(self, text):
@@ -89,11 +136,21 @@ class Sql(aiosqlite.Connection):
         await self.execute("replace into voltorb values (?, ?)", (channel.id, new_level))
 
     async def get_leaderboard_rank(self, player):
-        c = await self.execute("select score, rank () over (order by score desc) ranking from game where id = ?", (player.id,))
-        record = await c.fetchone()
-        return record
+        # Rank by the score including deltas which have not been flushed yet
+        pending = self.counters.pending_scores() if self.counters is not None else {}
+        ids = [player.id, *pending]
+        params = ', '.join('?' * len(ids))
+        stored = dict(await self.execute_fetchall(f"select id, score from game where id in ({params})", ids))
+        if player.id not in stored and player.id not in pending:
+            return None
+        score = stored.get(player.id, 0) + pending.get(player.id, (None, 0))[1]
+        (ahead,), = await self.execute_fetchall(f"select count(*) from game where score > ? and id not in ({params})", [score, *ids])
+        ahead += sum(stored.get(_id, 0) + by > score for _id, (name, by) in pending.items() if _id != player.id)
+        return score, ahead + 1
 
     async def reset_leaderboard(self):
+        if self.counters is not None:
+            self.counters.drop_scores()
         await self.execute("delete from game")
 
     async def remove_bag(self, msg):
@@ -106,29 +163,36 @@ class Sql(aiosqlite.Connection):
         await self.execute("delete from meme")
         await self.executemany("insert into meme values(?)", self.default_bag)
 
-    async def puppy_add_uranium(self):
-        await self.execute("update puppy set uranium = uranium + 1")
+    async def _update_puppy(self, column, by):
+        if self.counters is not None:
+            self.counters.add_puppy(column, by)
+        else:
+            await self.execute(f"update puppy set {column} = {column} + ?", (by,))
+
+    async def _get_puppy(self, column):
+        c = await self.execute(f"select {column} from puppy")
+        value, = await c.fetchone()
+        if self.counters is not None:
+            value += self.counters.pending_puppy(column)
+        return value
+
+    async def puppy_add_uranium(self, by=1):
+        await self._update_puppy('uranium', by)
 
     async def update_puppy_score(self, by):
-        await self.execute("update puppy set score_puppy = score_puppy + ?", (by,))
+        await self._update_puppy('score_puppy', by)
 
     async def update_dead_score(self, by):
-        await self.execute("update puppy set score_dead = score_dead + ?", (by,))
+        await self._update_puppy('score_dead', by)
 
     async def get_uranium(self):
-        c = await self.execute("select uranium from puppy")
-        uranium, = await c.fetchone()
-        return uranium
+        return await self._get_puppy('uranium')
 
     async def get_puppy_score(self):
-        c = await self.execute("select score_puppy from puppy")
-        score, = await c.fetchone()
-        return score
+        return await self._get_puppy('score_puppy')
 
     async def get_dead_score(self):
-        c = await self.execute("select score_dead from puppy")
-        score, = await c.fetchone()
-        return score
+        return await self._get_puppy('score_dead')
 
     async def backup_db(self):
         curtime = int(time.time())
@@ -144,19 +208,324 @@ class Sql(aiosqlite.Connection):
         await self._loop.run_in_executor(shutil.copy, dbbak, self.database)
         return dbbak
 
-    async def get_prefix(self, bot, message):
-        c = await self.execute("select prefix from prefixes where guild = ?", (message.guild.id,))
+    async def get_prefix(self, bot, guild):
+        c = await self.execute("select prefix from prefixes where guild = ?", (guild.id,))
         try:
             prefix, = await c.fetchone()
         except TypeError:
-            await self.set_prefix(message.guild, prefix=bot.settings.prefix)
+            await self.set_prefix(guild, prefix=bot.settings.prefix)
             prefix = bot.settings.prefix
         return prefix
 
+    async def get_all_prefixes(self):
+        return await self.execute_fetchall("select guild, prefix from prefixes")
+
     async def set_prefix(self, guild, prefix='p!'):
         await self.execute("replace into prefixes (guild, prefix) values (?, ?)", (guild.id, prefix))
 
 
+class CounterBuffer:
+    """Write-behind buffer for the game and puppy counters.
+
+    Deltas are merged in memory and written in a single transaction after
+    `interval` seconds or once `max_pending` deltas have accumulated,
+    whichever comes first.  Reads through :class:Sql add the pending deltas
+    on top of the stored values."""
+
+    def __init__(self, pool, *, interval=1.0, max_pending=100):
+        self._pool = pool
+        self.interval = interval
+        self.max_pending = max_pending
+        self._scores = {}
+        self._puppy = Counter()
+        self._inflight_scores = {}
+        self._inflight_puppy = Counter()
+        self._count = 0
+        self._handle = None
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def _schedule(self):
+        self._count += 1
+        if self._count >= self.max_pending:
+            self._start_flush()
+        else:
+            self._arm_timer()
+
+    def _arm_timer(self):
+        # A running flush rearms the timer itself when it finishes
+        if self._handle is None and self._task is None:
+            self._handle = self._pool._loop.call_later(self.interval, self._start_flush)
+
+    def _start_flush(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._task is None:
+            self._task = self._pool._loop.create_task(self._flush_task())
+
+    async def _flush_task(self):
+        try:
+            await self.flush()
+        except sqlite3.Error:
+            logging.getLogger('discord').exception(f'Failed to write counters, retrying in {self.interval} s')
+        finally:
+            self._task = None
+            # Deltas which came in meanwhile, or were put back after a failure
+            if self._count >= self.max_pending:
+                self._start_flush()
+            elif self._scores or self._puppy:
+                self._arm_timer()
+
+    def add_score(self, _id, name, by):
+        entry = self._scores.setdefault(_id, [name, 0])
+        entry[0] = name
+        entry[1] += by
+        self._schedule()
+
+    def add_puppy(self, column, by):
+        self._puppy[column] += by
+        self._schedule()
+
+    def pending_scores(self):
+        pending = {_id: list(entry) for _id, entry in self._inflight_scores.items()}
+        for _id, (name, by) in self._scores.items():
+            entry = pending.setdefault(_id, [name, 0])
+            entry[0] = name
+            entry[1] += by
+        return pending
+
+    def pending_puppy(self, column):
+        return self._inflight_puppy[column] + self._puppy[column]
+
+    def drop_scores(self):
+        self._scores.clear()
+        # A flush in flight is waiting for the writer lease, which the reset
+        # holds.  It reads the batch only once it gets the lease, so emptying
+        # it here keeps the old points from being written back.
+        self._inflight_scores = {}
+
+    def _restore(self, scores, puppy):
+        for _id, (name, by) in scores.items():
+            entry = self._scores.setdefault(_id, [name, 0])
+            entry[1] += by
+        self._puppy.update(puppy)
+
+    async def flush(self):
+        """Write all pending deltas to the database."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        async with self._lock:
+            if not self._scores and not self._puppy:
+                return
+            self._inflight_scores, self._scores = self._scores, {}
+            self._inflight_puppy, self._puppy = self._puppy, Counter()
+            self._count = 0
+            try:
+                async with self._pool.acquire() as sql:
+                    if self._inflight_scores:
+                        await sql.executemany(
+                            _score_upsert,
+                            [(_id, name, by) for _id, (name, by) in self._inflight_scores.items()]
+                        )
+                    if self._inflight_puppy:
+                        await sql.execute(_puppy_update, (
+                            self._inflight_puppy['uranium'],
+                            self._inflight_puppy['score_puppy'],
+                            self._inflight_puppy['score_dead']
+                        ))
+            except sqlite3.Error:
+                self._restore(self._inflight_scores, self._inflight_puppy)
+                raise
+            finally:
+                self._inflight_scores = {}
+                self._inflight_puppy = Counter()
+
+
+class SqlLease:
+    """Async context manager handing out a pooled connection.
+
+    Writer leases commit on exit, exactly like a standalone :class:Sql.
+    The connection is returned to the pool instead of being closed."""
+
+    __slots__ = ('_pool', '_readonly', '_conn')
+
+    def __init__(self, pool, readonly=False):
+        self._pool = pool
+        self._readonly = readonly
+        self._conn = None
+
+    async def __aenter__(self):
+        self._conn = await self._pool._acquire(self._readonly)
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        conn, self._conn = self._conn, None
+        try:
+            if conn is self._pool._writer:
+                await conn.commit()
+        finally:
+            self._pool._release(conn)
+
+
+class SqlPool:
+    """Long-lived connections to the sqlite database.
+
+    One writer connection is shared between all writer leases, which are
+    serialized by a lock.  Up to `readers` additional connections are
+    opened with `query_only` set and handed out to reader leases.
+    Connections are opened on first use and kept until :meth:close.
+
+    `storage` is the storage profile from the bot's settings.  Its pragmas
+    are applied to every connection as it is opened.  When the journal mode
+    is WAL, a background task checkpoints the log every `checkpoint_interval`
+    seconds, or with TRUNCATE as soon as it grows past `checkpoint_wal_size`
+    bytes."""
+
+    pragmas = 'synchronous', 'cache_size', 'mmap_size', 'temp_store'
+    checkpoint_poll = 15
+
+    def __init__(self, database, *, readers=4, storage=None, loop=None, **kwargs):
+        self.database = database
+        self._loop = loop or asyncio.get_event_loop()
+        self._kwargs = kwargs
+        self._nreaders = readers
+        self._storage = storage or {}
+        self._checkpoint_task = None
+        self.counters = CounterBuffer(self)
+        self._writer = None
+        self._writer_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        self._open_lock = asyncio.Lock()
+        self._closed = False
+
+        # Metrics
+        self.waiting = 0
+        self.in_use = 0
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def _open(self, readonly=False):
+        conn = await Sql(self.database, loop=self._loop, **self._kwargs)
+        conn.counters = self.counters
+        for pragma in self.pragmas:
+            value = self._storage.get(pragma)
+            if value is not None:
+                await conn.execute_fetchall(f'pragma {pragma} = {value}')
+        if readonly:
+            await conn.execute_fetchall('pragma query_only = 1')
+        return conn
+
+    async def _ensure_open(self):
+        if self._writer is not None:
+            return
+        async with self._open_lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError('Cannot operate on a closed pool.')
+            if self._writer is None:
+                writer = await self._open()
+                journal_mode = self._storage.get('journal_mode')
+                if journal_mode is not None:
+                    await writer.execute_fetchall(f'pragma journal_mode = {journal_mode}')
+                for _ in range(self._nreaders):
+                    self._readers.put_nowait(await self._open(readonly=True))
+                self._writer = writer
+                if str(journal_mode).lower() == 'wal':
+                    self._checkpoint_task = self._loop.create_task(self._checkpoint_loop())
+
+    async def _acquire(self, readonly):
+        await self._ensure_open()
+        readonly = readonly and self._nreaders > 0
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            if readonly:
+                conn = await self._readers.get()
+            else:
+                await self._writer_lock.acquire()
+                conn = self._writer
+        finally:
+            self.waiting -= 1
+        wait = time.perf_counter() - start
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.in_use += 1
+        return conn
+
+    def _release(self, conn):
+        self.in_use -= 1
+        if conn is self._writer:
+            self._writer_lock.release()
+        else:
+            self._readers.put_nowait(conn)
+
+    def acquire(self, readonly=False):
+        """Lease a connection.  Use as `async with pool.acquire() as sql`."""
+        return SqlLease(self, readonly)
+
+    async def checkpoint(self, mode='passive'):
+        """Checkpoint the write-ahead log.  Returns (busy, log pages, checkpointed pages)."""
+        async with self.acquire() as sql:
+            await sql.commit()
+            result, = await sql.execute_fetchall(f'pragma wal_checkpoint({mode})')
+            return result
+
+    async def _checkpoint_loop(self):
+        interval = self._storage.get('checkpoint_interval', 300)
+        max_size = self._storage.get('checkpoint_wal_size', 4194304)
+        mode = self._storage.get('checkpoint_mode', 'passive')
+        wal = f'{self.database}-wal'
+        last = time.monotonic()
+        while True:
+            await asyncio.sleep(min(interval, self.checkpoint_poll))
+            try:
+                size = os.path.getsize(wal)
+            except OSError:
+                size = 0
+            try:
+                if size > max_size:
+                    await self.checkpoint('truncate')
+                elif time.monotonic() - last >= interval:
+                    await self.checkpoint(mode)
+                else:
+                    continue
+            except sqlite3.Error:
+                continue
+            last = time.monotonic()
+
+    def stats(self):
+        """Acquire-latency and wait-queue metrics for this pool."""
+        return {
+            'readers': self._nreaders,
+            'in_use': self.in_use,
+            'waiting': self.waiting,
+            'acquired': self.acquired,
+            'mean_wait_ms': 1000 * self.total_wait / self.acquired if self.acquired else 0.0,
+            'max_wait_ms': 1000 * self.max_wait,
+        }
+
+    async def close(self):
+        if self._writer is not None:
+            await self.counters.flush()
+        async with self._open_lock:
+            self._closed = True
+            if self._checkpoint_task is not None:
+                self._checkpoint_task.cancel()
+                self._checkpoint_task = None
+            if self._writer is None:
+                return
+            async with self._writer_lock:
+                await self._writer.commit()
+                await self._writer.close()
+                self._writer = None
+            for _ in range(self._nreaders):
+                conn = await self._readers.get()
+                await conn.close()
+
+
 def connect(database, *, loop=None, **kwargs):
     """Create and return a connection proxy to the sqlite database."""
     return Sql(database, loop=loop, **kwargs)
@@ -0,0 +1,158 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import sqlite3
+import time
+
+
+__all__ = ('TimeSeriesStore',)
+
+
+class TimeSeriesStore:
+    """Persistent time series shared by the cogs that chart things.
+
+    Every sample is a (series, timestamp, value) row in one table keyed
+    by (series, ts), timestamps being unix seconds.  Cogs name their
+    series with a dotted prefix, e.g. `ping` or `status.<guild>.<status>`,
+    so a whole family can be read back with one range scan.
+
+    Samples are buffered in memory and inserted in one transaction every
+    `interval` seconds.  Reads include samples that have not been written
+    yet.  Rows older than `retention` seconds are pruned once per
+    `prune_interval`."""
+
+    def __init__(self, pool, *, interval=60.0, retention=7 * 86400, prune_interval=3600, loop=None):
+        self._pool = pool
+        self._loop = loop or asyncio.get_event_loop()
+        self.interval = interval
+        self.retention = retention
+        self.prune_interval = prune_interval
+        self._pending = []
+        self._inflight = []
+        self._handle = None
+        self._task = None
+        self._closed = False
+        self._lock = asyncio.Lock()
+        self._last_prune = 0
+        self.ready = asyncio.Event()
+        self._init_error = None
+
+    async def init_db(self, sql):
+        try:
+            await sql.execute("create table if not exists timeseries ("
+                              "series text not null, "
+                              "ts integer not null, "
+                              "value real not null, "
+                              "primary key (series, ts)"
+                              ") without rowid")
+        except Exception as e:
+            self.abort(e)
+            raise
+        self.ready.set()
+
+    def abort(self, exc):
+        """Mark initialization as failed.  Readers waiting on it, and any
+        later ones, raise instead of waiting forever."""
+        if not self.ready.is_set():
+            self._init_error = exc
+            self.ready.set()
+
+    def append(self, series, ts, value):
+        self._pending.append((series, int(ts), value))
+        self._arm_timer()
+
+    def _arm_timer(self):
+        # A running flush rearms the timer itself when it finishes
+        if self._handle is None and self._task is None and not self._closed:
+            self._handle = self._loop.call_later(self.interval, self._start_flush)
+
+    def _start_flush(self):
+        self._handle = None
+        if self._task is None:
+            self._task = self._loop.create_task(self._flush_task())
+
+    async def _flush_task(self):
+        try:
+            await self.flush()
+        except sqlite3.Error:
+            logging.getLogger('discord').exception(f'Failed to write time series, retrying in {self.interval} s')
+        finally:
+            self._task = None
+            # Samples which came in meanwhile, or were put back after a failure
+            if self._pending:
+                self._arm_timer()
+
+    def _buffered(self, lo, hi, since):
+        for series, ts, value in self._inflight + self._pending:
+            if lo <= series < hi and ts >= since:
+                yield series, ts, value
+
+    async def fetch(self, series, since=0):
+        """All samples of one series from `since` on, as (ts, value) in time order"""
+        return [(ts, value) for _, ts, value in await self._fetch(series, series + '\0', since)]
+
+    async def fetch_family(self, prefix, since=0):
+        """All samples of every series whose name starts with `prefix`, as
+        (series, ts, value) ordered by series then time"""
+        return await self._fetch(prefix, prefix + '\uffff', since)
+
+    async def _fetch(self, lo, hi, since):
+        await self.ready.wait()
+        if self._init_error is not None:
+            raise sqlite3.OperationalError('time series store failed to initialize') from self._init_error
+        async with self._pool.acquire(readonly=True) as sql:
+            rows = await sql.execute_fetchall(
+                "select series, ts, value from timeseries where series >= ? and series < ? and ts >= ?",
+                (lo, hi, since)
+            )
+        merged = {(series, ts): value for series, ts, value in rows}
+        for series, ts, value in self._buffered(lo, hi, since):
+            merged[series, ts] = value
+        return sorted((series, ts, value) for (series, ts), value in merged.items())
+
+    async def flush(self):
+        """Write all buffered samples to the database."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        await self.ready.wait()
+        async with self._lock:
+            if self._init_error is not None:
+                # There is no table to write to
+                self._pending = []
+                return
+            if not self._pending:
+                return
+            self._inflight, self._pending = self._pending, []
+            now = time.time()
+            try:
+                async with self._pool.acquire() as sql:
+                    await sql.executemany("replace into timeseries (series, ts, value) values (?, ?, ?)", self._inflight)
+                    if now - self._last_prune >= self.prune_interval:
+                        await sql.execute("delete from timeseries where ts < ?", (int(now - self.retention),))
+                        self._last_prune = now
+            except sqlite3.Error:
+                self._pending[:0] = self._inflight
+                raise
+            finally:
+                self._inflight = []
+
+    async def close(self):
+        self._closed = True
+        if self.ready.is_set() and self._init_error is None:
+            await self.flush()
@@ -0,0 +1,81 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import unittest
+import numpy as np
+from pikalaxbot.cogs.utils.cdi import CDIAccumulator
+
+
+def accumulate(samples):
+    """The original CDI formula: linearly weighted mean, newest weighted most"""
+    n = len(samples)
+    if n == 0:
+        return 0
+    return 2 * sum((i + 1) * x for i, x in enumerate(samples)) / (n * (n + 1))
+
+
+class CDIAccumulatorTest(unittest.TestCase):
+    """Drive the accumulator with random pushes, loads and new keys, and
+    check it against recomputing the formula from scratch every time."""
+
+    def run_trial(self, seed, window, scale, steps, new_key=0.05):
+        rng = random.Random(seed)
+        acc = CDIAccumulator(window, scale=scale, capacity=2)
+        samples = {}
+        averages = {}
+
+        def expected(key):
+            return accumulate(samples[key][-window:]) / scale
+
+        for _ in range(steps):
+            action = rng.random()
+            if action < new_key or not samples:
+                key = len(samples)
+                acc.add(key)
+                samples[key] = []
+                averages[key] = []
+            elif action < new_key + 0.03:
+                key = rng.choice(list(samples))
+                loaded = [rng.randrange(500) for _ in range(rng.randrange(3 * window))]
+                acc.load(key, loaded)
+                samples[key] = loaded
+                averages[key] = [accumulate(loaded[i - window:i]) / scale for i in range(window, len(loaded) + 1)]
+            else:
+                latest = np.zeros(len(acc), dtype=np.int64)
+                for key, row in acc.rows.items():
+                    latest[row] = x = rng.randrange(500) if rng.random() < 0.7 else 0
+                    samples[key].append(x)
+                    averages[key].append(expected(key))
+                acc.push(latest)
+
+            for key, row in acc.rows.items():
+                self.assertEqual(acc.count(key), min(len(samples[key]), window))
+                self.assertAlmostEqual(acc.average(key), expected(key), places=9)
+                self.assertAlmostEqual(acc.current()[row], expected(key), places=9)
+                np.testing.assert_allclose(acc.history(key), averages[key][-window:], rtol=1e-12, atol=1e-12)
+
+    def test_matches_formula(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                self.run_trial(seed, window=random.Random(seed).randrange(1, 12), scale=6, steps=300)
+
+    def test_long_window(self):
+        self.run_trial(1234, window=1440, scale=6, steps=1600, new_key=0.002)
+
+
+if __name__ == '__main__':
+    unittest.main()
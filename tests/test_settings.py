@@ -0,0 +1,68 @@
+# PikalaxBOT - A Discord bot in discord.py
+# Copyright (C) 2018  PikalaxALT
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import os
+import tempfile
+import types
+import unittest
+from pikalaxbot.cogs import BaseCog
+from pikalaxbot.utils.config_io import Settings
+
+
+class RolesCog(BaseCog):
+    roles = {}
+    config_attrs = 'roles',
+
+
+class CommitTest(unittest.TestCase):
+    """Cogs edit their settings in place and commit after each command."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmpdir.name, 'settings.json')
+        with open(self.fname, 'w') as fp:
+            json.dump({'token': 'token'}, fp)
+
+    def tearDown(self):
+        self.loop.close()
+        self.tmpdir.cleanup()
+
+    def saved_roles(self):
+        with open(self.fname) as fp:
+            return json.load(fp)['roles']
+
+    def test_in_place_edits_are_saved(self):
+        async def run():
+            settings = Settings(self.fname, loop=self.loop)
+            cog = RolesCog(types.SimpleNamespace(settings=settings))
+            await cog.fetch()
+            cog.roles['1'] = {'a': 10}
+            await cog.commit()
+            await settings.save()
+            self.assertEqual(self.saved_roles(), {'1': {'a': 10}})
+            cog.roles['1']['b'] = 20
+            await cog.commit()
+            await settings.save()
+            self.assertEqual(self.saved_roles(), {'1': {'a': 10, 'b': 20}})
+
+        self.loop.run_until_complete(run())
+
+
+if __name__ == '__main__':
+    unittest.main()